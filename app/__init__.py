@@ -1,76 +1,69 @@
 import os
-import sqlite3
 from flask import Flask
 from flask_socketio import SocketIO
 from .config import Config
+from .models.user import get_db
+from .migrations import run_migrations
+from .utils.metrics import metrics
 import logging
 from logging.handlers import RotatingFileHandler
 
-socketio = SocketIO()
+socket_emits = metrics.counter('socketio_emits_total', 'Socket.IO events emitted, by event name', ['event'])
+
+class InstrumentedSocketIO(SocketIO):
+    """Counts every emit, including flask_socketio.emit() from handlers, which goes through here."""
+
+    def emit(self, event, *args, **kwargs):
+        socket_emits.labels(event).inc()
+        return super().emit(event, *args, **kwargs)
+
+socketio = InstrumentedSocketIO()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    os.makedirs(app.config['HLS_FOLDER'], exist_ok=True)
     os.makedirs(os.path.join(app.instance_path, 'logs'), exist_ok=True)
 
     handler = RotatingFileHandler(os.path.join(app.instance_path, 'logs', 'app.log'), maxBytes=10000, backupCount=1)
     handler.setLevel(logging.INFO)
     app.logger.addHandler(handler)
 
-    socketio.init_app(app)
+    metrics.init_app(app)
+    from .utils import state
+    state.init_app(app)
+    socketio.init_app(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'], async_mode=app.config['SOCKETIO_ASYNC_MODE'])
 
     with app.app_context():
         db_path = app.config['DATABASE']
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        conn = sqlite3.connect(db_path)
-        conn.execute('''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            last_login TEXT,
-            active INTEGER NOT NULL
-        )''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS analytics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            viewers INTEGER NOT NULL,
-            type TEXT NOT NULL
-        )''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS stream_requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            status TEXT NOT NULL DEFAULT 'pending',
-            requested_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            read INTEGER NOT NULL DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-        conn.execute('''CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-        cursor = conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
-        if cursor.fetchone()[0] == 0:
-            from werkzeug.security import generate_password_hash
-            from datetime import datetime
-            conn.execute('INSERT INTO users (username, email, password, role, created_at, active) VALUES (?, ?, ?, ?, ?, ?)',
-                         ('admin', 'admin@example.com', generate_password_hash('admin123'), 'admin', datetime.now().isoformat(), 1))
-        conn.commit()
-        conn.close()
+        with get_db(app) as conn:
+            run_migrations(conn)
+            cursor = conn.execute('SELECT COUNT(*) FROM users WHERE username = ?', ('admin',))
+            if cursor.fetchone()[0] == 0:
+                from werkzeug.security import generate_password_hash
+                from datetime import datetime
+                # OR IGNORE : un autre worker démarré en même temps a pu le créer
+                conn.execute('INSERT OR IGNORE INTO users (username, email, password, role, created_at, active) VALUES (?, ?, ?, ?, ?, ?)',
+                             ('admin', 'admin@example.com', generate_password_hash('admin123'), 'admin', datetime.now().isoformat(), 1))
+                conn.commit()
+
+    from .models import access, messages
+    from .utils import passwords
+    passwords.init_app(app)
+    access.init_app(app)
+    messages.init_app(app)
+
+    from .utils.thumbnails import thumbnail_cache
+    from .utils.ingest import probe_worker
+    from .utils.camera_control import camera_control
+    from .utils.recaptcha import recaptcha
+    recaptcha.init_app(app)
+    thumbnail_cache.init_app(app)
+    probe_worker.init_app(app)
+    camera_control.init_app(app)
 
     from .routes.main import main_bp
     from .routes.auth import auth_bp
@@ -80,4 +73,13 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp)
 
+    from .models.analytics import viewer_aggregator
+    from .models.sessions import session_registry
+    from .routes.api import stats
+    from .utils.presence import presence
+    session_registry.init_app(app)
+    presence.init_app(app, socketio)
+    viewer_aggregator.init_app(app, sampler=lambda: session_registry.viewer_count() if stats['stream_active'] else 0,
+                               watch_counter=session_registry.take_watch_seconds)
+
     return app
\ No newline at end of file
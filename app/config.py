@@ -5,7 +5,85 @@ load_dotenv()
 
 class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
-    DATABASE = os.path.join(os.path.dirname(__file__), '..', 'instance', 'users.db')
+    DATABASE = os.getenv('DATABASE') or os.path.join(os.path.dirname(__file__), '..', 'instance', 'users.db')
+    DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 5.0))
+    # Connexions SQLite ouvertes au plus par processus, et attente maximale d'une connexion libre
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 16))
+    DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10.0))
+    DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+    DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 16384))
+    DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 ** 2))
+    DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', 256))
     UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
     RECAPTCHA_SITE_KEY = os.getenv('RECAPTCHA_SITE_KEY')
-    RECAPTCHA_SECRET_KEY = os.getenv('RECAPTCHA_SECRET_KEY')
\ No newline at end of file
+    RECAPTCHA_SECRET_KEY = os.getenv('RECAPTCHA_SECRET_KEY')
+    # 'google' en production, 'stub' pour les tests et les déploiements hors ligne
+    RECAPTCHA_BACKEND = os.getenv('RECAPTCHA_BACKEND', 'google')
+    RECAPTCHA_TIMEOUT = float(os.getenv('RECAPTCHA_TIMEOUT', 3.0))
+    RECAPTCHA_WORKERS = int(os.getenv('RECAPTCHA_WORKERS', 16))
+    # Méthode werkzeug, ex. 'scrypt:32768:8:1' ou 'pbkdf2:sha256:600000' ; les hashes existants sont mis à jour à la connexion
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    # Échecs de connexion tolérés par utilisateur et par IP : LOGIN_FAILURE_BURST, puis un toutes les 1/RATE secondes
+    LOGIN_FAILURE_RATE = float(os.getenv('LOGIN_FAILURE_RATE', 1 / 60))
+    LOGIN_FAILURE_BURST = int(os.getenv('LOGIN_FAILURE_BURST', 5))
+    # Les fichiers uploadés sont préfixés par un horodatage et ne changent jamais
+    VOD_MAX_AGE = int(os.getenv('VOD_MAX_AGE', 31536000))
+    # Délègue l'envoi des fichiers au serveur frontal (nginx, Apache) via X-Sendfile
+    USE_X_SENDFILE = os.getenv('USE_X_SENDFILE', '0') == '1'
+    HLS_FOLDER = os.path.join(os.path.dirname(__file__), 'static', 'hls')
+    HLS_SEGMENT_SECONDS = int(os.getenv('HLS_SEGMENT_SECONDS', 4))
+    HLS_LIST_SIZE = int(os.getenv('HLS_LIST_SIZE', 6))
+    MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 4 * 1024 ** 3))
+    MAX_CONTENT_LENGTH = MAX_UPLOAD_SIZE
+    THUMBNAIL_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'instance', 'thumbnails')
+    THUMBNAIL_CACHE_SIZE = int(os.getenv('THUMBNAIL_CACHE_SIZE', 256 * 1024 ** 2))
+    THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))
+    ACCESS_CACHE_TTL = float(os.getenv('ACCESS_CACHE_TTL', 300))
+    ACCESS_CACHE_SIZE = int(os.getenv('ACCESS_CACHE_SIZE', 10000))
+    CHAT_BATCH_SIZE = int(os.getenv('CHAT_BATCH_SIZE', 100))
+    CHAT_FLUSH_INTERVAL_MS = int(os.getenv('CHAT_FLUSH_INTERVAL_MS', 250))
+    # Tentatives d'écriture d'un lot avant de l'écrire ligne par ligne en abandonnant les lignes en échec
+    CHAT_WRITE_RETRIES = int(os.getenv('CHAT_WRITE_RETRIES', 5))
+    # Messages en attente d'écriture au-delà desquels les plus anciens sont abandonnés
+    CHAT_MAX_PENDING = int(os.getenv('CHAT_MAX_PENDING', 10000))
+    CHAT_MAX_MESSAGE_LENGTH = int(os.getenv('CHAT_MAX_MESSAGE_LENGTH', 500))
+    CHAT_RATE = float(os.getenv('CHAT_RATE', 1.0))
+    CHAT_BURST = int(os.getenv('CHAT_BURST', 5))
+    CHAT_HISTORY_SIZE = int(os.getenv('CHAT_HISTORY_SIZE', 500))
+    CHAT_JOIN_HISTORY = int(os.getenv('CHAT_JOIN_HISTORY', 50))
+    ANALYTICS_TICK_SECONDS = float(os.getenv('ANALYTICS_TICK_SECONDS', 5))
+    ANALYTICS_MINUTE_RETENTION_HOURS = int(os.getenv('ANALYTICS_MINUTE_RETENTION_HOURS', 48))
+    ANALYTICS_HOUR_RETENTION_DAYS = int(os.getenv('ANALYTICS_HOUR_RETENTION_DAYS', 90))
+    SESSION_HEARTBEAT_INTERVAL = float(os.getenv('SESSION_HEARTBEAT_INTERVAL', 15))
+    SESSION_HEARTBEAT_TIMEOUT = float(os.getenv('SESSION_HEARTBEAT_TIMEOUT', 45))
+    SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', 15))
+    PRESENCE_WINDOW_MS = int(os.getenv('PRESENCE_WINDOW_MS', 250))
+    NOTIFICATIONS_PAGE_SIZE = int(os.getenv('NOTIFICATIONS_PAGE_SIZE', 20))
+    # Demandes de stream acceptées d'office selon le rôle, ex. 'role:admin,role:moderator' ; vide : aucune
+    STREAM_AUTO_APPROVE = os.getenv('STREAM_AUTO_APPROVE', '')
+    # 'memory' pour un seul processus, 'redis' pour partager l'état entre plusieurs workers
+    STATE_BACKEND = os.getenv('STATE_BACKEND', 'memory')
+    STATE_REDIS_URL = os.getenv('STATE_REDIS_URL', 'redis://localhost:6379/0')
+    # Un worker sans battement depuis ce délai (s) est considéré mort : ses compteurs de spectateurs sont retirés
+    STATE_WORKER_TTL = float(os.getenv('STATE_WORKER_TTL', 15))
+    # File de messages Socket.IO (ex. redis://localhost:6379/1) pour que les emits atteignent tous les workers
+    SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+    # eventlet, gevent ou threading ; détecté automatiquement si absent (fixé par serve.py)
+    SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE') or None
+    # Jeton permettant à Prometheus de lire /api/metrics sans session admin (Authorization: Bearer ...) ; vide : admin seulement
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+    CAMERA_LOCK_TTL = float(os.getenv('CAMERA_LOCK_TTL', 10))
+    # Index de la webcam pour cv2.VideoCapture
+    CAMERA_DEVICE = int(os.getenv('CAMERA_DEVICE', 0))
+    # Mire de test (stream_type 'synthetic') : résolution LARGEURxHAUTEUR et cadence
+    SYNTHETIC_SIZE = os.getenv('SYNTHETIC_SIZE', '1280x720')
+    SYNTHETIC_FPS = float(os.getenv('SYNTHETIC_FPS', 30))
+    # Cadence de diffusion du live, en images par seconde (0 : celle de la webcam)
+    CAMERA_TARGET_FPS = float(os.getenv('CAMERA_TARGET_FPS', 0))
+    # Une scène figée n'est renvoyée que toutes les CAMERA_KEEPALIVE secondes
+    CAMERA_KEEPALIVE = float(os.getenv('CAMERA_KEEPALIVE', 2))
+    # Écart moyen (niveaux de gris) d'un bloc au-delà duquel le frame est considéré modifié ; 0 : tout envoyer
+    CAMERA_CHANGE_THRESHOLD = float(os.getenv('CAMERA_CHANGE_THRESHOLD', 4))
+    CAMERA_CHANGE_BLOCK = int(os.getenv('CAMERA_CHANGE_BLOCK', 8))
@@ -0,0 +1,48 @@
+import importlib
+import logging
+import pkgutil
+from datetime import datetime
+
+def _migrations():
+    """Migration modules of this package, ordered by version (vNNN_name.py)."""
+    modules = []
+    for info in pkgutil.iter_modules(__path__):
+        if info.name.startswith('v') and info.name[1:4].isdigit():
+            modules.append((int(info.name[1:4]), info.name))
+    return sorted(modules)
+
+def current_version(conn):
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def run_migrations(conn):
+    """Apply every migration newer than the recorded schema version, each in its own transaction.
+
+    Several workers may start at once: each migration takes the write lock
+    (BEGIN IMMEDIATE) and re-reads the version, so exactly one applies it.
+    """
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )''')
+    conn.commit()
+    for number, name in _migrations():
+        if number <= current_version(conn):
+            continue
+        module = importlib.import_module(f"{__name__}.{name}")
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Relu sous le verrou : un autre worker a pu l'appliquer entre-temps
+            if number <= current_version(conn):
+                conn.rollback()
+                continue
+            module.upgrade(conn)
+            conn.execute('INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)',
+                         (number, name, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"Échec de la migration {name}")
+            raise
+        logging.info(f"Migration appliquée : {name}")
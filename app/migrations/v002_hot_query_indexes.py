@@ -0,0 +1,12 @@
+"""Indexes for the hot query paths."""
+
+def upgrade(conn):
+    # Dernière demande d'un utilisateur (à chaque message du chat) : index couvrant
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stream_requests_user_requested ON stream_requests (user_id, requested_at DESC, status)')
+    # Liste des demandes en attente côté admin
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_stream_requests_status_requested ON stream_requests (status, requested_at DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_created ON notifications (user_id, created_at DESC)')
+    # SUM(viewers) WHERE type = ? lu uniquement depuis l'index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_analytics_type_viewers ON analytics (type, viewers)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_last_login ON users (last_login DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_videos_status_created ON videos (status, created_at DESC)')
@@ -0,0 +1,14 @@
+"""Rollup table for viewer analytics (minute, hour, day and all-time buckets)."""
+
+def upgrade(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS analytics_rollups (
+        resolution TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        samples INTEGER NOT NULL DEFAULT 0,
+        sum_viewers INTEGER NOT NULL DEFAULT 0,
+        min_viewers INTEGER,
+        max_viewers INTEGER,
+        joins INTEGER NOT NULL DEFAULT 0,
+        watch_seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (resolution, bucket)
+    ) WITHOUT ROWID''')
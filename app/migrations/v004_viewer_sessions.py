@@ -0,0 +1,14 @@
+"""Completed viewer sessions, one row per socket session on the stream page."""
+
+def upgrade(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS viewer_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        sid TEXT NOT NULL,
+        joined_at TEXT NOT NULL,
+        left_at TEXT NOT NULL,
+        watch_seconds REAL NOT NULL,
+        reason TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_viewer_sessions_user_joined ON viewer_sessions (user_id, joined_at DESC)')
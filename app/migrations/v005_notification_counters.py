@@ -0,0 +1,9 @@
+"""Unread notification counter per user and keyset index for paginated notifications."""
+
+def upgrade(conn):
+    conn.execute('ALTER TABLE users ADD COLUMN unread_notifications INTEGER NOT NULL DEFAULT 0')
+    conn.execute('''UPDATE users SET unread_notifications = (
+        SELECT COUNT(*) FROM notifications n WHERE n.user_id = users.id AND n.read = 0)''')
+    # Pages de notifications : WHERE user_id = ? AND id < ? ORDER BY id DESC
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications (user_id, id DESC)')
+    conn.execute('DROP INDEX IF EXISTS idx_notifications_user_created')
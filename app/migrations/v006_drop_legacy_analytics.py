@@ -0,0 +1,6 @@
+"""Drop the raw analytics table, superseded by analytics_rollups since v003."""
+
+def upgrade(conn):
+    # Les anciennes lignes (un événement par connexion) ne se convertissent pas en échantillons : pas de reprise
+    conn.execute('DROP INDEX IF EXISTS idx_analytics_type_viewers')
+    conn.execute('DROP TABLE IF EXISTS analytics')
@@ -0,0 +1,41 @@
+from .user import get_db
+from ..utils.cache import TTLCache
+from ..utils.state import state, decode
+
+# Statut de la dernière demande de stream et profil, par user_id
+access_cache = TTLCache()
+
+def init_app(app):
+    access_cache.configure(app.config['ACCESS_CACHE_SIZE'], app.config['ACCESS_CACHE_TTL'])
+    # Les invalidations sont diffusées à tous les workers
+    state.subscribe('access', lambda message: access_cache.invalidate(decode(message)))
+
+def get_user_access(app, user_id):
+    """Return the user's latest stream request status and profile, from cache when possible."""
+    access = access_cache.get(user_id)
+    if access is not None:
+        return access
+    # Pris avant la lecture : si une invalidation survient pendant celle-ci, le résultat n'est pas mis en cache
+    generation = access_cache.generation(user_id)
+    with get_db(app) as conn:
+        user = conn.execute('SELECT username, email, role, active FROM users WHERE id = ?', (user_id,)).fetchone()
+        if not user:
+            return None
+        request = conn.execute('SELECT status FROM stream_requests WHERE user_id = ? ORDER BY requested_at DESC LIMIT 1', (user_id,)).fetchone()
+    access = {
+        'user_id': user_id,
+        'username': user['username'],
+        'email': user['email'],
+        'role': user['role'],
+        'active': bool(user['active']),
+        'status': request['status'] if request else None,
+    }
+    access_cache.set(user_id, access, generation)
+    return access
+
+def can_chat(access):
+    return access is not None and access['active'] and access['status'] == 'accepted'
+
+def invalidate_user_access(user_id):
+    """Drop the cached entry, on every worker, after a request is accepted/rejected or the user is promoted/deactivated."""
+    state.publish('access', user_id)
@@ -1,8 +1,154 @@
-from datetime import datetime
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
 from .user import get_db
+from ..utils.state import state, WORKER_ID
 
-def log_viewer_count(app, viewers):
+# Format de clé de bucket par résolution ; 'total' n'a qu'une ligne
+RESOLUTIONS = {
+    'minute': '%Y-%m-%dT%H:%M',
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+    'total': None,
+}
+
+class ViewerAggregator:
+    """Samples concurrent viewers on a fixed tick and maintains minute/hour/day rollups."""
+
+    def __init__(self):
+        self.app = None
+        self.sampler = lambda: 0
+        self.watch_counter = None
+        self.tick = 5.0
+        self.retention = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self._reset(None)
+
+    def _reset(self, minute):
+        self.minute = minute
+        self.samples = 0
+        self.sum_viewers = 0
+        self.min_viewers = None
+        self.max_viewers = None
+        self.joins = 0
+        self.watch_seconds = 0.0
+
+    def init_app(self, app, sampler, watch_counter=None):
+        self.app = app
+        self.sampler = sampler
+        self.watch_counter = watch_counter
+        self.tick = app.config['ANALYTICS_TICK_SECONDS']
+        self.retention = {
+            'minute': timedelta(hours=app.config['ANALYTICS_MINUTE_RETENTION_HOURS']),
+            'hour': timedelta(days=app.config['ANALYTICS_HOUR_RETENTION_DAYS']),
+        }
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='analytics-aggregator', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def record_join(self):
+        with self.lock:
+            self.joins += 1
+
+    def sample(self, now=None):
+        now = now or datetime.now()
+        # Avec plusieurs workers, un seul échantillonne le nombre de spectateurs (global)
+        leader = state.acquire_lock('analytics', WORKER_ID, self.tick * 3)
+        viewers = int(self.sampler()) if leader else 0
+        # Temps de visionnage exact si un compteur est fourni, sinon estimé par échantillonnage
+        watch_seconds = self.watch_counter() if self.watch_counter else viewers * self.tick
+        minute = now.replace(second=0, microsecond=0)
+        pending = None
+        with self.lock:
+            if self.minute is not None and minute != self.minute:
+                pending = self._take_locked()
+            if self.minute is None:
+                self.minute = minute
+            if leader:
+                self.samples += 1
+                self.sum_viewers += viewers
+                self.min_viewers = viewers if self.min_viewers is None else min(self.min_viewers, viewers)
+                self.max_viewers = viewers if self.max_viewers is None else max(self.max_viewers, viewers)
+            self.watch_seconds += watch_seconds
+        if pending is not None:
+            self._write(*pending)
+
+    def _run(self):
+        while not self.stop_event.wait(self.tick):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"Erreur d'agrégation des statistiques : {str(e)}")
+
+    def flush(self):
+        with self.lock:
+            pending = self._take_locked()
+        if pending is not None:
+            self._write(*pending)
+
+    def _take_locked(self):
+        if self.minute is None or (self.samples == 0 and self.joins == 0 and not self.watch_seconds):
+            self._reset(None)
+            return None
+        rows = []
+        for resolution, fmt in RESOLUTIONS.items():
+            bucket = self.minute.strftime(fmt) if fmt else 'all'
+            rows.append((resolution, bucket, self.samples, self.sum_viewers, self.min_viewers,
+                         self.max_viewers, self.joins, self.watch_seconds))
+        minute = self.minute
+        self._reset(None)
+        return minute, rows
+
+    def _write(self, minute, rows):
+        with get_db(self.app) as conn:
+            conn.executemany('''INSERT INTO analytics_rollups (resolution, bucket, samples, sum_viewers, min_viewers, max_viewers, joins, watch_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (resolution, bucket) DO UPDATE SET
+                    samples = samples + excluded.samples,
+                    sum_viewers = sum_viewers + excluded.sum_viewers,
+                    min_viewers = MIN(COALESCE(min_viewers, excluded.min_viewers), COALESCE(excluded.min_viewers, min_viewers)),
+                    max_viewers = MAX(COALESCE(max_viewers, excluded.max_viewers), COALESCE(excluded.max_viewers, max_viewers)),
+                    joins = joins + excluded.joins,
+                    watch_seconds = watch_seconds + excluded.watch_seconds''', rows)
+            if minute.minute == 0:
+                # Rétention appliquée une fois par heure, via la clé primaire
+                for resolution, keep in self.retention.items():
+                    cutoff = (minute - keep).strftime(RESOLUTIONS[resolution])
+                    conn.execute('DELETE FROM analytics_rollups WHERE resolution = ? AND bucket < ?', (resolution, cutoff))
+            conn.commit()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.tick + 1)
+            self.thread = None
+        self.flush()
+
+viewer_aggregator = ViewerAggregator()
+
+def get_rollups(app, resolution, limit):
+    """Most recent `limit` buckets at the given resolution, oldest first."""
+    with get_db(app) as conn:
+        rows = conn.execute('SELECT bucket, samples, sum_viewers, min_viewers, max_viewers, joins, watch_seconds FROM analytics_rollups WHERE resolution = ? ORDER BY bucket DESC LIMIT ?',
+                           (resolution, limit)).fetchall()
+    return [{
+        'bucket': row['bucket'],
+        'avg_viewers': row['sum_viewers'] / row['samples'] if row['samples'] else 0,
+        'min_viewers': row['min_viewers'],
+        'max_viewers': row['max_viewers'],
+        'joins': row['joins'],
+        'watch_seconds': row['watch_seconds'],
+    } for row in reversed(rows)]
+
+def get_totals(app):
+    """All-time totals, read from a single precomputed row."""
     with get_db(app) as conn:
-        conn.execute('INSERT INTO analytics (timestamp, viewers, type) VALUES (?, ?, ?)',
-                    (datetime.now().isoformat(), viewers, 'hourly'))
-        conn.commit()
\ No newline at end of file
+        row = conn.execute('SELECT joins, watch_seconds, max_viewers FROM analytics_rollups WHERE resolution = ? AND bucket = ?',
+                          ('total', 'all')).fetchone()
+    if not row:
+        return {'joins': 0, 'watch_seconds': 0, 'max_viewers': 0}
+    return {'joins': row['joins'], 'watch_seconds': row['watch_seconds'], 'max_viewers': row['max_viewers'] or 0}
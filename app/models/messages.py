@@ -0,0 +1,206 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from .user import get_db
+from ..utils.metrics import metrics
+from ..utils.ratelimit import RateLimiter
+from ..utils.state import state, decode
+
+class MessageWriter:
+    """Write-behind buffer: chat messages are broadcast first and persisted in batches."""
+
+    def __init__(self):
+        self.app = None
+        self.buffer = []
+        self.condition = threading.Condition()
+        self.batch_size = 100
+        self.flush_interval = 0.25
+        self.thread = None
+        self.running = False
+        self.max_pending = 10000
+        self.max_retries = 5
+        # Lot en échec, retenté avant tout nouveau message
+        self.failed = []
+        self.attempts = 0
+        self.flushed = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config['CHAT_BATCH_SIZE']
+        self.flush_interval = app.config['CHAT_FLUSH_INTERVAL_MS'] / 1000.0
+        self.max_pending = app.config['CHAT_MAX_PENDING']
+        self.max_retries = app.config['CHAT_WRITE_RETRIES']
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name='chat-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, message_id, user_id, message, created_at):
+        with self.condition:
+            self.buffer.append((message_id, user_id, message, created_at))
+            overflow = len(self.buffer) + len(self.failed) - self.max_pending
+            if overflow > 0:
+                # Base indisponible trop longtemps : les plus anciens messages en attente ne seront pas persistés
+                del self.buffer[:overflow]
+                self.dropped += overflow
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+        if overflow > 0:
+            logging.error(f"File d'écriture du chat pleine, {overflow} message(s) abandonné(s)")
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if self.running and len(self.buffer) < self.batch_size:
+                    # Au plus flush_interval de messages perdus en cas de crash
+                    self.condition.wait(timeout=self.flush_interval)
+                running = self.running
+            if not self.flush() and running:
+                time.sleep(self.flush_interval)
+            if not running:
+                break
+
+    def flush(self):
+        """Write one batch; returns False if it failed and is kept for a retry."""
+        with self.condition:
+            if self.failed:
+                batch, self.failed = self.failed, []
+            else:
+                batch, self.buffer = self.buffer, []
+                self.attempts = 0
+        if not batch:
+            return True
+        try:
+            self._write(batch)
+            return True
+        except Exception as e:
+            self.attempts += 1
+            logging.error(f"Erreur lors de l'écriture de {len(batch)} messages (tentative {self.attempts}) : {str(e)}")
+        if self.attempts < self.max_retries:
+            with self.condition:
+                self.failed = batch
+            return False
+        # Dernière tentative ligne par ligne : seules les lignes en échec sont abandonnées
+        for row in batch:
+            try:
+                self._write([row])
+            except Exception as e:
+                self.dropped += 1
+                logging.error(f"Message {row[0]} abandonné après {self.attempts} tentatives : {str(e)}")
+        self.attempts = 0
+        return True
+
+    def _write(self, batch):
+        with get_db(self.app) as conn:
+            conn.executemany('INSERT INTO messages (id, user_id, message, created_at) VALUES (?, ?, ?, ?)', batch)
+            conn.commit()
+        self.flushed += len(batch)
+        self.batches += 1
+
+    def stop(self):
+        if self.thread is None:
+            return
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout=5)
+        self.thread = None
+        # Vide le lot en échec puis le reste du tampon, sans attendre entre les tentatives
+        for _ in range(self.max_retries + 2):
+            self.flush()
+            with self.condition:
+                if not self.buffer and not self.failed:
+                    break
+
+    def stats(self):
+        with self.condition:
+            pending = len(self.buffer) + len(self.failed)
+        return {'pending': pending, 'flushed': self.flushed, 'batches': self.batches, 'dropped': self.dropped}
+
+class ChatHistory:
+    """Ring buffer of the most recent messages; older pages are read from the database by id.
+
+    Each worker keeps its own ring, fed by the 'chat' channel of the state backend.
+    """
+
+    def __init__(self, size=500):
+        self.messages = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        size = app.config['CHAT_HISTORY_SIZE']
+        with get_db(app) as conn:
+            last_id = conn.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+            rows = conn.execute('SELECT m.id, u.username, m.message, m.created_at FROM messages m JOIN users u ON u.id = m.user_id ORDER BY m.id DESC LIMIT ?',
+                               (size,)).fetchall()
+        # Les ids sont attribués par le backend pour que l'historique soit paginable avant l'écriture en base
+        current = state.get('message_id', 0)
+        if current < last_id:
+            state.incr('message_id', last_id - current)
+        with self.lock:
+            self.messages = deque((_row_to_dict(row) for row in reversed(rows)), maxlen=size)
+        state.subscribe('chat', self._on_message)
+
+    def _on_message(self, message):
+        self.append(decode(message))
+
+    def append(self, entry):
+        with self.lock:
+            if self.messages and entry['id'] < self.messages[-1]['id']:
+                # Deux workers peuvent publier dans le désordre
+                self.messages = deque(sorted([*self.messages, entry], key=lambda m: m['id']), maxlen=self.messages.maxlen)
+            else:
+                self.messages.append(entry)
+
+    def before(self, before_id, limit):
+        """Up to `limit` messages older than before_id (newest first), and whether the ring may not hold them all."""
+        with self.lock:
+            page = [m for m in reversed(self.messages) if before_id is None or m['id'] < before_id][:limit]
+            full = len(self.messages) == self.messages.maxlen
+        return page, full
+
+def _row_to_dict(row):
+    return {'id': row['id'], 'username': row['username'], 'message': row['message'], 'created_at': row['created_at']}
+
+message_writer = MessageWriter()
+chat_limiter = RateLimiter()
+chat_history = ChatHistory()
+
+messages_recorded = metrics.counter('chat_messages_total', 'Chat messages accepted on this worker')
+metrics.counter('chat_rejected_total', 'Chat messages refused by the rate limiter', fn=lambda: chat_limiter.rejected)
+metrics.gauge('chat_writer_pending', 'Chat messages waiting to be written to the database',
+              fn=lambda: message_writer.stats()['pending'])
+
+def init_app(app):
+    chat_limiter.configure(app.config['CHAT_RATE'], app.config['CHAT_BURST'])
+    chat_history.init_app(app)
+    message_writer.init_app(app)
+
+def record_message(user_id, username, message, created_at):
+    """Add a message to the recent history of every worker and queue it for persistence."""
+    entry = {'id': state.incr('message_id'), 'username': username, 'message': message, 'created_at': created_at}
+    messages_recorded.inc()
+    state.publish('chat', entry)
+    message_writer.submit(entry['id'], user_id, message, created_at)
+    return entry
+
+def get_messages(app, before_id=None, limit=50):
+    """Keyset-paginated history, newest first: from the ring buffer, then from the database."""
+    page, ring_full = chat_history.before(before_id, limit)
+    if len(page) < limit and ring_full:
+        # Le tampon ne couvre pas tout : on complète avec l'index primaire de la table
+        cursor_id = page[-1]['id'] if page else before_id
+        with get_db(app) as conn:
+            if cursor_id is None:
+                rows = conn.execute('SELECT m.id, u.username, m.message, m.created_at FROM messages m JOIN users u ON u.id = m.user_id ORDER BY m.id DESC LIMIT ?',
+                                   (limit - len(page),)).fetchall()
+            else:
+                rows = conn.execute('SELECT m.id, u.username, m.message, m.created_at FROM messages m JOIN users u ON u.id = m.user_id WHERE m.id < ? ORDER BY m.id DESC LIMIT ?',
+                                   (cursor_id, limit - len(page))).fetchall()
+        page += [_row_to_dict(row) for row in rows]
+    return page
@@ -1,24 +1,86 @@
-
-import sqlite3
 from datetime import datetime
 from .user import get_db
 
+def user_room(user_id):
+    """Socket.IO room joined by every connection of a user."""
+    return f"user_{user_id}"
+
+def _row_to_dict(row):
+    return {'id': row['id'], 'message': row['message'], 'created_at': row['created_at'], 'read': row['read']}
+
+def insert_notifications(conn, items):
+    """Insert notifications for (user_id, message) pairs inside the caller's transaction.
+
+    Returns (user_id, notification) pairs in the order of items; push them
+    with push_notifications() after commit.
+    """
+    created_at = datetime.now().isoformat()
+    rows = []
+    for start in range(0, len(items), 500):
+        chunk = items[start:start + 500]
+        rows += conn.execute(f"""INSERT INTO notifications (user_id, message, created_at, read)
+            VALUES {','.join(['(?, ?, ?, 0)'] * len(chunk))} RETURNING id, user_id, message, created_at, read""",
+                             [value for user_id, message in chunk for value in (user_id, message, created_at)]).fetchall()
+    conn.executemany('UPDATE users SET unread_notifications = unread_notifications + 1 WHERE id = ?',
+                     [(user_id,) for user_id, _ in items])
+    # RETURNING ne garantit pas l'ordre des lignes ; les id, eux, suivent celui des VALUES
+    rows.sort(key=lambda row: row['id'])
+    return [(row['user_id'], _row_to_dict(row)) for row in rows]
+
+def push_notifications(app, pushed):
+    """Push (user_id, notification) pairs, reading every unread counter in one query."""
+    if not pushed:
+        return
+    user_ids = sorted({user_id for user_id, _ in pushed})
+    unread = {}
+    with get_db(app) as conn:
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            for row in conn.execute(f"SELECT id, unread_notifications FROM users WHERE id IN ({','.join('?' * len(chunk))})", chunk):
+                unread[row['id']] = row['unread_notifications']
+    from .. import socketio
+    for user_id, notification in pushed:
+        socketio.emit('notification_created', {'notification': notification, 'unread': unread.get(user_id, 0)},
+                      to=user_room(user_id))
+
 def create_notification(app, user_id, message):
-    """Create a new notification for a user."""
+    """Create a new notification for a user and push it to their open pages."""
     with get_db(app) as conn:
-        conn.execute('INSERT INTO notifications (user_id, message, created_at, read) VALUES (?, ?, ?, ?)',
-                    (user_id, message, datetime.now().isoformat(), 0))
+        pushed = insert_notifications(conn, [(user_id, message)])
         conn.commit()
+    push_notifications(app, pushed)
+    return pushed[0][1]
 
-def get_user_notifications(app, user_id):
-    """Retrieve all notifications for a user."""
+def get_user_notifications(app, user_id, before_id=None, limit=20):
+    """One page of a user's notifications, newest first, keyset-paginated by id."""
     with get_db(app) as conn:
-        notifications = conn.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? ORDER BY created_at DESC',
-                                    (user_id,)).fetchall()
-        return [{'id': row['id'], 'message': row['message'], 'created_at': row['created_at'], 'read': row['read']} for row in notifications]
+        if before_id is None:
+            notifications = conn.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                                        (user_id, limit)).fetchall()
+        else:
+            notifications = conn.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+                                        (user_id, before_id, limit)).fetchall()
+        return [_row_to_dict(row) for row in notifications]
+
+def get_unread_count(app, user_id):
+    with get_db(app) as conn:
+        row = conn.execute('SELECT unread_notifications FROM users WHERE id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
 
 def mark_notification_read(app, notification_id):
     """Mark a notification as read."""
     with get_db(app) as conn:
-        conn.execute('UPDATE notifications SET read = 1 WHERE id = ?', (notification_id,))
-        conn.commit()
\ No newline at end of file
+        cursor = conn.execute('UPDATE notifications SET read = 1 WHERE id = ? AND read = 0', (notification_id,))
+        if cursor.rowcount:
+            conn.execute('''UPDATE users SET unread_notifications = MAX(unread_notifications - 1, 0)
+                WHERE id = (SELECT user_id FROM notifications WHERE id = ?)''', (notification_id,))
+        conn.commit()
+
+def delete_notification(app, notification_id):
+    """Delete a notification, keeping the unread counter in step."""
+    with get_db(app) as conn:
+        # Lecture et suppression en une instruction : de deux suppressions simultanées, une seule décrémente
+        row = conn.execute('DELETE FROM notifications WHERE id = ? RETURNING user_id, read', (notification_id,)).fetchone()
+        if row is not None and not row['read']:
+            conn.execute('UPDATE users SET unread_notifications = MAX(unread_notifications - 1, 0) WHERE id = ?', (row['user_id'],))
+        conn.commit()
@@ -0,0 +1,176 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+from .user import get_db
+from ..utils.state import state
+
+class ViewerSession:
+    __slots__ = ('sid', 'user_id', 'username', 'email', 'joined_at', 'started', 'last_seen', 'accounted')
+
+    def __init__(self, sid, user_id, username, email, now):
+        self.sid = sid
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+        self.joined_at = datetime.now()
+        self.started = now
+        self.last_seen = now
+        self.accounted = now
+
+class SessionRegistry:
+    """Stream-page sessions keyed by socket sid, with heartbeat expiry and batched persistence.
+
+    Sessions live in the worker holding the socket; the per-user session counts
+    are kept in the state backend so every worker sees the same viewer count.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.sessions = {}
+        self.by_user = {}
+        self.completed = []
+        self.watch_accrued = 0.0
+        self.lock = threading.Lock()
+        self.heartbeat_timeout = 45.0
+        self.sweep_interval = 15.0
+        self.thread = None
+        self.stop_event = threading.Event()
+        # Appelé avec les user_id dont la dernière session a expiré
+        self.on_expire = None
+
+    def init_app(self, app):
+        self.app = app
+        self.heartbeat_timeout = app.config['SESSION_HEARTBEAT_TIMEOUT']
+        self.sweep_interval = app.config['SESSION_SWEEP_INTERVAL']
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='viewer-sessions', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+        state.subscribe('sessions', lambda message: self.end_all())
+
+    def join(self, sid, user_id, username, email):
+        """Register a stream-page socket. Returns True if the user was not already watching."""
+        now = time.monotonic()
+        with self.lock:
+            if sid in self.sessions:
+                self.sessions[sid].last_seen = now
+                return False
+            self.sessions[sid] = ViewerSession(sid, user_id, username, email, now)
+            self.by_user.setdefault(user_id, set()).add(sid)
+        return state.hincr('viewers', user_id, 1) == 1
+
+    def heartbeat(self, sid):
+        """Refresh a session. Returns False for an unknown sid (expired or never joined), which the caller may rejoin."""
+        with self.lock:
+            session = self.sessions.get(sid)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                return True
+            return False
+
+    def leave(self, sid, reason='disconnect'):
+        """Close a session. Returns the user_id if that was the user's last open session."""
+        with self.lock:
+            session = self._close_locked(sid, time.monotonic(), reason)
+        if session is None or state.hincr('viewers', session.user_id, -1) > 0:
+            return None
+        return session.user_id
+
+    def end_all(self, reason='stream_stop'):
+        now = time.monotonic()
+        with self.lock:
+            closed = [self._close_locked(sid, now, reason) for sid in list(self.sessions)]
+        for session in closed:
+            state.hincr('viewers', session.user_id, -1)
+
+    def end_all_workers(self):
+        """End the stream-page sessions held by every worker."""
+        state.publish('sessions', 'end_all')
+
+    def _close_locked(self, sid, now, reason):
+        session = self.sessions.pop(sid, None)
+        if session is None:
+            return None
+        # Une session expirée s'arrête à son dernier signe de vie
+        end = session.last_seen if reason == 'timeout' else now
+        self.watch_accrued += max(0.0, end - session.accounted)
+        sids = self.by_user.get(session.user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.by_user[session.user_id]
+        watch_seconds = max(0.0, end - session.started)
+        left_at = datetime.now() if reason != 'timeout' else datetime.fromtimestamp(time.time() - (now - end))
+        self.completed.append((session.user_id, sid, session.joined_at.isoformat(), left_at.isoformat(), watch_seconds, reason))
+        return session
+
+    def viewer_count(self):
+        """Concurrent viewers: distinct users with at least one open session, on any worker."""
+        return state.hlen('viewers')
+
+    def connected_users(self):
+        with self.lock:
+            users = {}
+            for session in self.sessions.values():
+                users.setdefault(session.user_id, {'id': session.user_id, 'username': session.username, 'email': session.email})
+            return list(users.values())
+
+    def take_watch_seconds(self):
+        """Exact watch-seconds accrued since the previous call, for the analytics aggregator.
+
+        Open sessions are counted up to their last heartbeat, the end used if
+        they later time out; the remainder is counted once the next heartbeat
+        or the close arrives.
+        """
+        with self.lock:
+            total = self.watch_accrued
+            self.watch_accrued = 0.0
+            for session in self.sessions.values():
+                if session.last_seen > session.accounted:
+                    total += session.last_seen - session.accounted
+                    session.accounted = session.last_seen
+            return total
+
+    def sweep(self):
+        """Expire sessions without heartbeat. Returns the user_ids that are no longer watching."""
+        now = time.monotonic()
+        with self.lock:
+            expired = [self._close_locked(sid, now, 'timeout') for sid, session in list(self.sessions.items())
+                       if now - session.last_seen > self.heartbeat_timeout]
+        return [session.user_id for session in expired if state.hincr('viewers', session.user_id, -1) <= 0]
+
+    def flush(self):
+        with self.lock:
+            batch, self.completed = self.completed, []
+        if not batch:
+            return
+        try:
+            with get_db(self.app) as conn:
+                conn.executemany('INSERT INTO viewer_sessions (user_id, sid, joined_at, left_at, watch_seconds, reason) VALUES (?, ?, ?, ?, ?, ?)', batch)
+                conn.commit()
+        except Exception as e:
+            logging.error(f"Erreur lors de l'écriture de {len(batch)} sessions : {str(e)}")
+            with self.lock:
+                self.completed = batch + self.completed
+
+    def _run(self):
+        while not self.stop_event.wait(self.sweep_interval):
+            try:
+                gone = self.sweep()
+                if gone and self.on_expire is not None:
+                    self.on_expire(gone)
+                self.flush()
+            except Exception as e:
+                logging.error(f"Erreur lors du suivi des sessions : {str(e)}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.sweep_interval + 1)
+            self.thread = None
+        self.end_all(reason='shutdown')
+        self.flush()
+
+session_registry = SessionRegistry()
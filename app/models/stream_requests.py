@@ -1,6 +1,9 @@
-import sqlite3
+import logging
 from datetime import datetime
+from functools import lru_cache
 from .user import get_db
+from .access import invalidate_user_access
+from .notifications import insert_notifications
 
 def create_stream_request(app, user_id):
     """Create a new stream request for a user."""
@@ -8,6 +11,7 @@ def create_stream_request(app, user_id):
         conn.execute('INSERT INTO stream_requests (user_id, status, requested_at) VALUES (?, ?, ?)',
                     (user_id, 'pending', datetime.now().isoformat()))
         conn.commit()
+    invalidate_user_access(user_id)
 
 def get_pending_requests(app):
     """Retrieve all pending stream requests."""
@@ -18,5 +22,70 @@ def get_pending_requests(app):
 def update_stream_request(app, request_id, status):
     """Update the status of a stream request (accepted or rejected)."""
     with get_db(app) as conn:
+        row = conn.execute('SELECT user_id FROM stream_requests WHERE id = ?', (request_id,)).fetchone()
         conn.execute('UPDATE stream_requests SET status = ? WHERE id = ?', (status, request_id))
         conn.commit()
+    if row:
+        invalidate_user_access(row['user_id'])
+
+STATUS_BY_ACTION = {'accept': 'accepted', 'reject': 'rejected'}
+
+def resolve_requests(app, action, request_ids=None):
+    """Accept or reject pending requests (the given ids, or all of them) in one transaction.
+
+    Returns the resolved requests with the notification created for each user;
+    pass them to push_notifications() once the caller is ready to emit.
+    """
+    status = STATUS_BY_ACTION[action]
+    message = f'Votre demande pour rejoindre le live a été { "acceptée" if action == "accept" else "refusée" }.'
+    query = 'SELECT sr.id, sr.user_id, u.username, u.email FROM stream_requests sr JOIN users u ON sr.user_id = u.id WHERE sr.status = ?'
+    with get_db(app) as conn:
+        # Verrou d'écriture pris avant la lecture : deux actions groupées simultanées ne traitent pas les mêmes demandes
+        conn.execute('BEGIN IMMEDIATE')
+        if request_ids is None:
+            rows = conn.execute(query, ('pending',)).fetchall()
+        else:
+            request_ids = sorted(set(request_ids))
+            rows = []
+            for start in range(0, len(request_ids), 500):
+                chunk = request_ids[start:start + 500]
+                rows += conn.execute(f"{query} AND sr.id IN ({','.join('?' * len(chunk))})", ['pending', *chunk]).fetchall()
+        # Seules les lignes réellement passées de 'pending' au nouveau statut sont notifiées
+        rows = [row for row in rows
+                if conn.execute('UPDATE stream_requests SET status = ? WHERE id = ? AND status = ?',
+                                (status, row['id'], 'pending')).rowcount == 1]
+        if not rows:
+            conn.rollback()
+            return []
+        notifications = insert_notifications(conn, [(row['user_id'], message) for row in rows])
+        conn.commit()
+    resolved = []
+    for row, (_, notification) in zip(rows, notifications):
+        invalidate_user_access(row['user_id'])
+        resolved.append({
+            'request_id': row['id'],
+            'user_id': row['user_id'],
+            'username': row['username'],
+            'email': row['email'],
+            'status': status,
+            'notification': notification,
+        })
+    return resolved
+
+@lru_cache(maxsize=8)
+def parse_auto_approve_rules(value):
+    """'role:admin,role:moderator' -> {'roles': {'admin', 'moderator'}}."""
+    rules = {'roles': set()}
+    for rule in filter(None, (part.strip() for part in (value or '').split(','))):
+        if rule == 'returning':
+            # Règle retirée : une demande n'est créée que sans demande antérieure, donc jamais pour un habitué
+            logging.warning("Règle d'approbation automatique 'returning' ignorée (retirée)")
+        elif rule.startswith('role:'):
+            rules['roles'].add(rule[5:])
+        else:
+            raise ValueError(f"Règle d'approbation automatique inconnue : {rule}")
+    return rules
+
+def auto_approves(rules, access):
+    """Evaluate the rules against the cached access profile: no query per request."""
+    return access['role'] in rules['roles']
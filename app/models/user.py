@@ -1,12 +1,205 @@
 from contextlib import contextmanager
+import atexit
+import queue
 import sqlite3
-from flask import current_app
+import threading
+import time
+from ..utils.concurrency import blocking
+from ..utils.metrics import metrics
+
+# Connexion empruntée par le thread (ou greenlet) courant, pour les appels imbriqués de get_db
+_local = threading.local()
+_pools = {}
+_pools_lock = threading.Lock()
+_stats_lock = threading.Lock()
+pool_stats = {
+    'connections': 0,
+    'checkouts': 0,
+    'wait_time': 0.0,
+    'timeouts': 0,
+    'lock_failures': 0,
+    'queries': 0,
+    'query_time': 0.0,
+}
+
+query_seconds = metrics.histogram('db_query_seconds', 'SQLite execute/executemany/commit time, busy waits included')
+checkout_seconds = metrics.histogram('db_checkout_seconds', 'Time to obtain a pooled connection')
+metrics.counter('db_pool_events_total', 'Connection pool events', ['event'],
+                fn=lambda: {key: value for key, value in get_pool_stats().items()
+                            if key in ('connections', 'checkouts', 'timeouts', 'lock_failures')})
+metrics.gauge('db_pool_connections', 'Open pooled connections, by state', ['state'],
+              fn=lambda: {state: value for state, value in get_pool_stats().items() if state in ('idle', 'in_use')})
+
+def _count(key, value=1):
+    with _stats_lock:
+        pool_stats[key] += value
+
+def _record_query(elapsed):
+    query_seconds.observe(elapsed)
+    with _stats_lock:
+        pool_stats['queries'] += 1
+        pool_stats['query_time'] += elapsed
+
+def _is_locked(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements run off the event loop and are timed.
+
+    Lock contention is handled by SQLite itself through busy_timeout
+    (DB_BUSY_TIMEOUT); there is no retry on top of it.
+    """
+
+    def _run(self, method, *args):
+        start = time.perf_counter()
+        try:
+            # Sous eventlet/gevent, la requête SQLite s'exécute dans le pool de threads natifs
+            return blocking(method, *args)
+        except sqlite3.OperationalError as e:
+            if _is_locked(e):
+                _count('lock_failures')
+            raise
+        finally:
+            _record_query(time.perf_counter() - start)
+
+    def execute(self, *args):
+        return self._run(super().execute, *args)
+
+    def executemany(self, *args):
+        return self._run(super().executemany, *args)
+
+    def commit(self):
+        return self._run(super().commit)
+
+def _connect(app):
+    config = app.config
+    conn = sqlite3.connect(config['DATABASE'], timeout=config['DB_BUSY_TIMEOUT'],
+                           factory=PooledConnection, cached_statements=config['DB_STATEMENT_CACHE'],
+                           check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f"PRAGMA synchronous={config['DB_SYNCHRONOUS']}")
+    conn.execute(f"PRAGMA cache_size={-int(config['DB_CACHE_SIZE_KB'])}")
+    conn.execute(f"PRAGMA mmap_size={int(config['DB_MMAP_SIZE'])}")
+    conn.execute(f"PRAGMA busy_timeout={int(config['DB_BUSY_TIMEOUT'] * 1000)}")
+    conn.execute('PRAGMA temp_store=MEMORY')
+    _count('connections')
+    return conn
+
+class ConnectionPool:
+    """At most DB_POOL_SIZE connections to one database, lent for the duration of a get_db() block."""
+
+    def __init__(self, app):
+        self.app = app
+        self.size = app.config['DB_POOL_SIZE']
+        self.timeout = app.config['DB_POOL_TIMEOUT']
+        # LIFO : les connexions les plus récemment utilisées (cache chaud) repartent en premier
+        self.idle = queue.LifoQueue()
+        self.open = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.open < self.size
+            if create:
+                self.open += 1
+        if create:
+            try:
+                return _connect(self.app)
+            except Exception:
+                with self.lock:
+                    self.open -= 1
+                raise
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            _count('timeouts')
+            raise sqlite3.OperationalError(f"Aucune connexion disponible après {self.timeout} s ({self.size} en cours d'utilisation)")
+
+    def release(self, conn):
+        try:
+            # Comme l'ancienne fermeture de connexion : ce qui n'est pas commité est annulé
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self.idle.put(conn)
+
+    def _discard(self, conn):
+        with self.lock:
+            self.open -= 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def stats(self):
+        idle = self.idle.qsize()
+        return {'size': self.size, 'idle': idle, 'in_use': self.open - idle}
+
+def _pool(app):
+    path = app.config['DATABASE']
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(app)
+    return pool
 
 @contextmanager
 def get_db(app):
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.row_factory = sqlite3.Row
+    path = app.config['DATABASE']
+    held = getattr(_local, 'held', None)
+    if held is None:
+        held = _local.held = {}
+    if path in held:
+        # Appel imbriqué : même connexion, donc même transaction
+        yield held[path]
+        return
+    pool = _pool(app)
+    start = time.perf_counter()
+    conn = pool.acquire()
+    elapsed = time.perf_counter() - start
+    _count('checkouts')
+    _count('wait_time', elapsed)
+    checkout_seconds.observe(elapsed)
+    held[path] = conn
     try:
         yield conn
     finally:
-        conn.close()
\ No newline at end of file
+        del held[path]
+        pool.release(conn)
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+atexit.register(close_pools)
+
+def get_pool_stats():
+    with _stats_lock:
+        stats = dict(pool_stats)
+    stats.update({'size': 0, 'idle': 0, 'in_use': 0})
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for key, value in pool.stats().items():
+            stats[key] += value
+    return stats
@@ -0,0 +1,42 @@
+from datetime import datetime
+from .user import get_db
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv')
+
+def _row_to_dict(row):
+    return {key: row[key] for key in row.keys()}
+
+def create_video(app, filename, size, sha256=None):
+    """Register an uploaded video; metadata is filled in later by the probe worker."""
+    with get_db(app) as conn:
+        conn.execute('INSERT OR IGNORE INTO videos (filename, size, sha256, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                    (filename, size, sha256, 'pending', datetime.now().isoformat()))
+        conn.commit()
+
+def update_video_metadata(app, filename, metadata):
+    """Store probed metadata (duration, resolution, fps, codec) for a video."""
+    with get_db(app) as conn:
+        conn.execute('UPDATE videos SET duration = ?, width = ?, height = ?, fps = ?, codec = ?, status = ? WHERE filename = ?',
+                    (metadata.get('duration'), metadata.get('width'), metadata.get('height'), metadata.get('fps'),
+                     metadata.get('codec'), metadata['status'], filename))
+        conn.commit()
+
+def list_videos(app):
+    """Retrieve all playable or pending videos, newest first."""
+    with get_db(app) as conn:
+        videos = conn.execute('SELECT filename, size, sha256, duration, width, height, fps, codec, status, created_at FROM videos WHERE status != ? ORDER BY created_at DESC',
+                             ('invalid',)).fetchall()
+        return [_row_to_dict(row) for row in videos]
+
+def get_video(app, filename):
+    """Retrieve a single video by filename."""
+    with get_db(app) as conn:
+        row = conn.execute('SELECT filename, size, sha256, duration, width, height, fps, codec, status, created_at FROM videos WHERE filename = ?',
+                          (filename,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+def unregistered_files(app, filenames):
+    """Return the files present on disk that have no row in the videos table yet."""
+    with get_db(app) as conn:
+        known = {row['filename'] for row in conn.execute('SELECT filename FROM videos').fetchall()}
+    return [f for f in filenames if f not in known]
@@ -1,8 +1,24 @@
-from flask import Blueprint, request, current_app, session, Response
+from flask import Blueprint, request, current_app, session, Response, jsonify, send_from_directory, send_file, abort, url_for
 from ..utils.camera import Camera
-from ..models.analytics import log_viewer_count
-from ..models.user import get_db
+from ..utils.camera_control import camera_control
+from ..utils.sources import LIVE_STREAM_TYPES, create_source
+from ..utils.state import SharedStats
+from ..utils import hls
+from ..utils.ingest import probe_worker, save_stream, UploadError
+from ..utils.thumbnails import thumbnail_cache, SPRITE_COLUMNS, SPRITE_ROWS
+from ..models.videos import list_videos as list_video_rows, get_video
+from ..models.analytics import get_rollups, get_totals
+from ..models.sessions import session_registry
+from ..utils.presence import presence
+from ..utils.recaptcha import recaptcha
+from ..utils.metrics import metrics, profiler
+from ..models.user import get_db, get_pool_stats
+from ..models.access import access_cache, invalidate_user_access, get_user_access, can_chat
+from ..models.messages import message_writer, chat_limiter, get_messages
+from ..models.notifications import user_room, get_user_notifications, get_unread_count, mark_notification_read, delete_notification
 from .auth import admin_required, login_required
+from werkzeug.security import safe_join
+import hmac
 import os
 import time
 import logging
@@ -13,21 +29,26 @@ api_bp = Blueprint('api', __name__)
 logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='a', format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-stats = {
-    'viewers': 0,
-    'total_views': 0,
-    'stream_active': False,
-    'uptime': 0,
-    'video_path': None,
-    'start_time': None,
-    'stream_type': None
-}
+# Partagé entre les workers via le backend d'état
+stats = SharedStats()
+
+def _live_source(stream_type, options):
+    config = current_app.config
+    if stream_type == 'webcam':
+        return create_source('webcam', device=config['CAMERA_DEVICE'])
+    if stream_type == 'live_video':
+        path = safe_join(config['UPLOAD_FOLDER'], options.get('video_path') or '')
+        if path is None or not options.get('video_path'):
+            raise ValueError("Vidéo non valide")
+        return create_source('file', path=path, loop=options.get('loop', True))
+    width, height = (int(value) for value in config['SYNTHETIC_SIZE'].split('x'))
+    return create_source('synthetic', width=width, height=height, fps=config['SYNTHETIC_FPS'],
+                         pattern=options.get('pattern', 'bars'))
 
 @api_bp.route('/api/control_stream', methods=['POST'])
 @admin_required
 def control_stream():
     logger.debug(f"Requête reçue pour /api/control_stream: {request.json}")
-    global stats
     action = request.json.get('action')
     stream_type = request.json.get('stream_type')
     video_path = request.json.get('video_path')
@@ -40,19 +61,47 @@ def control_stream():
         if stats['stream_active']:
             logger.warning("Stream déjà actif")
             return Response('Stream déjà actif', status=400)
+        source = None
+        if stream_type in LIVE_STREAM_TYPES:
+            try:
+                source = _live_source(stream_type, request.json)
+            except ValueError as e:
+                logger.error(f"Source non valide: {str(e)}")
+                return Response(str(e), status=400)
+        vod_path = None
+        if stream_type == 'video' and video_path:
+            # Même garde que pour la rediffusion : pas de chemin hors du dossier d'upload
+            vod_path = safe_join(current_app.config['UPLOAD_FOLDER'], video_path)
+            if vod_path is None or not os.path.isfile(vod_path):
+                logger.error(f"Vidéo non valide: {video_path}")
+                return Response('Vidéo introuvable', status=404)
         stats['stream_active'] = True
         stats['start_time'] = time.time()
         stats['stream_type'] = stream_type
-        if stream_type == 'video' and video_path:
+        if vod_path is not None:
             stats['video_path'] = video_path
-        elif stream_type == 'webcam':
-            stats['video_path'] = None
+            if not hls.segment_video(vod_path, current_app.config['HLS_FOLDER'], current_app.config['HLS_SEGMENT_SECONDS']):
+                logger.warning("ffmpeg introuvable, pas de segmentation HLS")
+        elif source is not None:
+            # Webcam, fichier rediffusé en direct ou mire : même pipeline, tous les spectateurs synchronisés
+            stats['video_path'] = video_path if stream_type == 'live_video' else None
             try:
-                Camera.get_instance().start(upload_folder=current_app.config['UPLOAD_FOLDER'])
+                camera = camera_control.start(upload_folder=current_app.config['UPLOAD_FOLDER'], source=source)
             except Exception as e:
-                logger.error(f"Erreur lors du démarrage de la webcam: {str(e)}")
-                return Response('Erreur lors du démarrage de la webcam', status=500)
-        log_viewer_count(current_app, stats['viewers'])
+                logger.error(f"Erreur lors du démarrage de la source {source.describe()}: {str(e)}")
+                stats['stream_active'] = False
+                stats['start_time'] = None
+                stats['stream_type'] = None
+                stats['video_path'] = None
+                return Response('Erreur lors du démarrage du stream', status=500)
+            if hls.ffmpeg_binary() is not None:
+                try:
+                    hls.start_live(camera, current_app.config['HLS_FOLDER'],
+                                   current_app.config['HLS_SEGMENT_SECONDS'], current_app.config['HLS_LIST_SIZE'])
+                except Exception as e:
+                    logger.error(f"Erreur lors du démarrage de la segmentation HLS: {str(e)}")
+            else:
+                logger.warning("ffmpeg introuvable, pas de segmentation HLS")
         logger.info("Stream démarré")
         return Response(status=204)
 
@@ -61,12 +110,13 @@ def control_stream():
             logger.warning("Aucun stream actif")
             return Response('Aucun stream actif', status=400)
         stats['stream_active'] = False
+        session_registry.end_all_workers()
+        presence.clear()
         stats['viewers'] = 0
         stats['start_time'] = None
         stats['stream_type'] = None
         stats['video_path'] = None
-        Camera.get_instance().stop()
-        log_viewer_count(current_app, stats['viewers'])
+        camera_control.stop()
         logger.info("Stream arrêté")
         return Response(status=204)
 
@@ -74,69 +124,161 @@ def control_stream():
 @admin_required
 def upload():
     logger.debug("Requête reçue pour /api/upload")
-    if 'file' not in request.files:
-        logger.error("Aucun fichier fourni")
-        return Response('Aucun fichier fourni', status=400)
-    file = request.files['file']
-    if file.filename == '':
+    # Seul le corps brut est accepté (application/octet-stream, nom dans ?filename=) : il est lu
+    # directement depuis la socket, alors qu'un formulaire multipart serait d'abord recopié par Werkzeug
+    if request.mimetype != 'application/octet-stream':
+        logger.error(f"Type de contenu non supporté: {request.mimetype}")
+        return Response('Envoyez le fichier en application/octet-stream, nom dans ?filename=', status=415)
+    stream = request.stream
+    original_name = os.path.basename(request.args.get('filename', '').replace('\\', '/'))
+    if original_name == '':
         logger.error("Aucun fichier sélectionné")
         return Response('Aucun fichier sélectionné', status=400)
-    if file and file.filename.endswith(('.mp4', '.avi', '.mkv')):
-        filename = f"{int(time.time())}_{file.filename}"
-        file.save(os.path.join(current_app.config['UPLOAD_FOLDER'], filename))
-        logger.info(f"Fichier uploadé: {filename}")
-        return Response(status=204)
-    logger.error("Format de fichier non supporté")
-    return Response('Format de fichier non supporté', status=400)
+    filename = f"{int(time.time())}_{original_name}"
+    try:
+        result = save_stream(stream, current_app.config['UPLOAD_FOLDER'], filename, current_app.config['MAX_UPLOAD_SIZE'])
+    except UploadError as e:
+        logger.error(f"Upload refusé: {str(e)}")
+        return Response(str(e), status=e.status)
+    probe_worker.register(filename, result['size'], result['sha256'])
+    logger.info(f"Fichier uploadé: {filename} ({result['size']} octets, sha256={result['sha256']})")
+    return jsonify(result), 201
 
 @api_bp.route('/api/stream')
 def stream():
-    if not stats['stream_active'] or stats['stream_type'] != 'webcam':
-        logger.error("Aucun stream webcam actif")
-        return Response('Aucun stream webcam actif', status=400)
-    return Response(Camera.get_instance().gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    if not stats['stream_active'] or stats['stream_type'] not in LIVE_STREAM_TYPES:
+        logger.error("Aucun stream en direct actif")
+        return Response('Aucun stream en direct actif', status=400)
+    rendition = request.args.get('q', Camera.DEFAULT_RENDITION)
+    if rendition not in Camera.RENDITIONS:
+        logger.error(f"Rendu non valide: {rendition}")
+        return Response('Rendu non valide', status=400)
+    return Response(Camera.get_instance().gen_frames(rendition), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@api_bp.route('/api/vod/<path:name>')
+def vod(name):
+    if not name.endswith(('.mp4', '.avi', '.mkv')):
+        abort(404)
+    # send_file gère Range/206, ETag et Last-Modified, et passe par wsgi.file_wrapper
+    # (sendfile) sans charger le fichier en mémoire
+    response = send_from_directory(current_app.config['UPLOAD_FOLDER'], name,
+                                   conditional=True, etag=True,
+                                   max_age=current_app.config['VOD_MAX_AGE'])
+    response.cache_control.immutable = True
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+@api_bp.route('/api/hls/<path:name>')
+def hls_file(name):
+    if not name.endswith(('.m3u8', '.ts')):
+        abort(404)
+    response = send_from_directory(current_app.config['HLS_FOLDER'], name, conditional=True, etag=True)
+    if name.endswith('.ts'):
+        # Un segment n'est jamais réécrit : un proxy de cache peut absorber la diffusion
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['VOD_MAX_AGE']
+        response.cache_control.immutable = True
+    elif name.startswith(hls.LIVE_KEY + '/'):
+        # La playlist live change à chaque segment
+        response.cache_control.public = True
+        response.cache_control.max_age = 1
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['VOD_MAX_AGE']
+    response.cache_control.no_cache = None
+    return response
 
 @api_bp.route('/api/videos', methods=['GET'])
 @admin_required
 def list_videos():
     logger.debug("Requête reçue pour /api/videos")
-    upload_folder = current_app.config['UPLOAD_FOLDER']
-    videos = [f for f in os.listdir(upload_folder) if f.endswith(('.mp4', '.avi', '.mkv'))]
-    logger.info(f"Vidéos récupérées: {videos}")
-    return jsonify({'videos': videos}), 200
+    rows = list_video_rows(current_app)
+    videos = [row['filename'] for row in rows]
+    for row in rows:
+        row['thumbnail_url'] = url_for('api.video_preview', name=row['filename'], kind='thumbnail')
+        row['sprite_url'] = url_for('api.video_preview', name=row['filename'], kind='sprite')
+    logger.info(f"Vidéos récupérées: {len(videos)}")
+    return jsonify({'videos': videos, 'details': rows,
+                    'sprite': {'columns': SPRITE_COLUMNS, 'rows': SPRITE_ROWS}}), 200
+
+@api_bp.route('/api/videos/<path:name>/<any(thumbnail, sprite):kind>', methods=['GET'])
+@admin_required
+def video_preview(name, kind):
+    video = get_video(current_app, name)
+    if video is None or video['status'] != 'ready':
+        abort(404)
+    path = thumbnail_cache.get(name, kind)
+    if path is None:
+        # Génération en cours dans le pool de processus : le client réessaie
+        response = Response('Aperçu en cours de génération', status=202)
+        response.headers['Retry-After'] = '1'
+        return response
+    response = send_file(path, mimetype='image/jpeg', conditional=True, etag=True, max_age=3600)
+    response.cache_control.private = True
+    response.cache_control.public = None
+    return response
+
+@api_bp.route('/api/notifications', methods=['GET'])
+@login_required
+def notifications():
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', current_app.config['NOTIFICATIONS_PAGE_SIZE'], type=int), 1), 100)
+    page = get_user_notifications(current_app, session['user_id'], before_id, limit)
+    return jsonify({
+        'notifications': page,
+        'unread': get_unread_count(current_app, session['user_id']),
+        'has_more': len(page) == limit,
+        'next_before_id': page[-1]['id'] if page else None,
+    }), 200
 
 @api_bp.route('/api/notifications/<int:notification_id>/<action>', methods=['POST'])
 @login_required
 def manage_notification(notification_id, action):
     logger.debug(f"Requête reçue pour /api/notifications/{notification_id}/{action}, user_id={session['user_id']}")
-    from ..models.notifications import mark_notification_read
     if action not in ['read', 'delete']:
         logger.error(f"Action non valide: {action}")
         return Response('Action non valide', status=400)
     with get_db(current_app) as conn:
         notification = conn.execute('SELECT id, user_id, message, read, created_at FROM notifications WHERE id = ?', (notification_id,)).fetchone()
-        logger.debug(f"Notification trouvée: {dict(notification) if notification else None}")
-        if not notification:
-            logger.error(f"Notification ID {notification_id} non trouvée")
-            return Response('Notification non trouvée', status=404)
-        if notification['user_id'] != session['user_id']:
-            logger.error(f"Accès non autorisé: user_id={session['user_id']} tente d'accéder à notification_id={notification_id}")
-            return Response('Accès non autorisé', status=403)
-        if action == 'read':
-            if notification['read']:
-                logger.warning(f"Notification {notification_id} déjà lue")
-                return Response('Notification déjà lue', status=400)
-            mark_notification_read(current_app, notification_id)
-            logger.info(f"Notification {notification_id} marquée comme lue")
-        elif action == 'delete':
-            conn.execute('DELETE FROM notifications WHERE id = ?', (notification_id,))
-            conn.commit()
-            logger.info(f"Notification {notification_id} supprimée")
+    logger.debug(f"Notification trouvée: {dict(notification) if notification else None}")
+    if not notification:
+        logger.error(f"Notification ID {notification_id} non trouvée")
+        return Response('Notification non trouvée', status=404)
+    if notification['user_id'] != session['user_id']:
+        logger.error(f"Accès non autorisé: user_id={session['user_id']} tente d'accéder à notification_id={notification_id}")
+        return Response('Accès non autorisé', status=403)
+    if action == 'read':
+        if notification['read']:
+            logger.warning(f"Notification {notification_id} déjà lue")
+            return Response('Notification déjà lue', status=400)
+        mark_notification_read(current_app, notification_id)
+        logger.info(f"Notification {notification_id} marquée comme lue")
+    elif action == 'delete':
+        delete_notification(current_app, notification_id)
+        logger.info(f"Notification {notification_id} supprimée")
     from .. import socketio
-    socketio.emit('notification_updated', {'notification_id': notification_id, 'action': action}, to=str(session['user_id']))
+    socketio.emit('notification_updated', {
+        'notification_id': notification_id,
+        'action': action,
+        'unread': get_unread_count(current_app, session['user_id']),
+    }, to=user_room(session['user_id']))
     logger.debug(f"Événement SocketIO 'notification_updated' émis pour notification_id={notification_id}, action={action}")
     return Response(status=204)
 
+@api_bp.route('/api/messages', methods=['GET'])
+@login_required
+def messages():
+    if not can_chat(get_user_access(current_app, session['user_id'])):
+        return Response('Accès non autorisé', status=403)
+    before_id = request.args.get('before_id', type=int)
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+    page = get_messages(current_app, before_id, limit)
+    return jsonify({
+        'messages': list(reversed(page)),
+        'has_more': len(page) == limit,
+        'next_before_id': page[-1]['id'] if page else None,
+    }), 200
+
 @api_bp.route('/api/control_recording', methods=['POST'])
 @admin_required
 def control_recording():
@@ -145,24 +287,83 @@ def control_recording():
     if action not in ['start', 'stop']:
         logger.error(f"Action non valide: {action}")
         return Response('Action non valide', status=400)
-    camera = Camera.get_instance()
     if action == 'start':
-        if camera.recording:
+        if camera_control.recording:
             logger.warning("Enregistrement déjà en cours")
             return Response('Enregistrement déjà en cours', status=400)
-        if camera.start_recording():
+        if camera_control.start_recording():
             logger.info("Enregistrement démarré")
             return Response(status=204)
         logger.error("Impossible de démarrer l'enregistrement")
         return Response('Impossible de démarrer l\'enregistrement', status=500)
     if action == 'stop':
-        if not camera.recording:
+        if not camera_control.recording:
             logger.warning("Aucun enregistrement en cours")
             return Response('Aucun enregistrement en cours', status=400)
-        camera.stop_recording()
+        camera_control.stop_recording()
         logger.info("Enregistrement arrêté")
         return Response(status=204)
 
+@api_bp.route('/api/recording_status', methods=['GET'])
+@admin_required
+def recording_status():
+    return jsonify({'recording': camera_control.recording, 'stats': camera_control.recording_stats()}), 200
+
+@api_bp.route('/api/camera_stats', methods=['GET'])
+@admin_required
+def camera_stats():
+    return jsonify(camera_control.capture_stats()), 200
+
+@api_bp.route('/api/presence', methods=['GET'])
+@login_required
+def presence_snapshot():
+    return jsonify(presence.snapshot()), 200
+
+@api_bp.route('/api/analytics', methods=['GET'])
+@admin_required
+def analytics():
+    resolution = request.args.get('resolution', 'hour')
+    if resolution not in ('minute', 'hour', 'day'):
+        return Response('Résolution non valide', status=400)
+    limit = min(max(request.args.get('limit', 24, type=int), 1), 1440)
+    return jsonify({'rollups': get_rollups(current_app, resolution, limit), 'totals': get_totals(current_app)}), 200
+
+@api_bp.route('/api/db_stats', methods=['GET'])
+@admin_required
+def db_stats():
+    return jsonify(get_pool_stats()), 200
+
+@api_bp.route('/api/cache_stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    return jsonify({
+        'access': access_cache.stats(),
+        'chat_writer': message_writer.stats(),
+        'chat_rejected': chat_limiter.rejected,
+        'recaptcha': recaptcha.stats(),
+    }), 200
+
+@api_bp.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    authorized = session.get('role') == 'admin' or (
+        token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'))
+    if not authorized:
+        return Response('Accès réservé aux administrateurs', status=403)
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@api_bp.route('/api/profile', methods=['GET'])
+@admin_required
+def profile():
+    # Échantillonne les piles de tous les threads pendant la durée demandée ; réponse au format « collapsed stacks »
+    seconds = min(max(request.args.get('seconds', 10, type=float), 0.1), current_app.config['PROFILE_MAX_SECONDS'])
+    rate = min(max(request.args.get('hz', 100, type=float), 1), 1000)
+    logger.info(f"Profilage démarré pour {seconds} s à {rate} Hz")
+    stacks = profiler.profile(seconds, 1 / rate)
+    if stacks is None:
+        return Response('Un profilage est déjà en cours', status=409)
+    return Response(stacks, mimetype='text/plain')
+
 @api_bp.route('/api/promote_user/<int:user_id>', methods=['POST'])
 @admin_required
 def promote_user(user_id):
@@ -178,6 +379,7 @@ def promote_user(user_id):
         conn.execute('UPDATE users SET role = ? WHERE id = ?', ('admin', user_id))
         conn.commit()
         logger.info(f"Utilisateur {user['username']} (ID {user_id}) promu administrateur")
+    invalidate_user_access(user_id)
     from .. import socketio
     socketio.emit('user_promoted', {'user_id': user_id, 'username': user['username']}, to='admin_room')
     logger.debug(f"Événement SocketIO 'user_promoted' émis pour user_id={user_id}")
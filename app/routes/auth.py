@@ -1,8 +1,9 @@
 from flask import Blueprint, render_template, session, request, redirect, url_for, flash, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
 from ..models.user import get_db
+from ..utils.recaptcha import recaptcha
+from ..utils.passwords import password_hasher, login_limiter
 from datetime import datetime
-import requests
+import sqlite3
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -26,41 +27,49 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def verify_recaptcha(response_token):
-    """Vérifie la réponse reCAPTCHA auprès de l'API de Google."""
-    secret_key = current_app.config['RECAPTCHA_SECRET_KEY']
-    payload = {
-        'secret': secret_key,
-        'response': response_token
-    }
-    response = requests.post('https://www.google.com/recaptcha/api/siteverify', data=payload)
-    result = response.json()
-    return result.get('success', False)
+def _login_failed(limiter_keys):
+    # Chaque échec, CAPTCHA compris, consomme un jeton par utilisateur et par IP
+    for key in limiter_keys:
+        login_limiter.allow(key)
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        limiter_keys = (('user', username), ('ip', request.remote_addr))
+        # Vérifié avant le CAPTCHA et le hash : une rafale refusée ne coûte rien
+        if not all(login_limiter.check(key) for key in limiter_keys):
+            flash('Trop de tentatives de connexion, réessayez plus tard.', 'error')
+            return render_template('login.html'), 429
         recaptcha_response = request.form.get('g-recaptcha-response')
         if not recaptcha_response:
+            _login_failed(limiter_keys)
             flash('Veuillez compléter le CAPTCHA.', 'error')
             return redirect(url_for('auth.login'))
-        if not verify_recaptcha(recaptcha_response):
+        # Le CAPTCHA est validé avant toute lecture en base et tout calcul de hash
+        if not recaptcha.verify(recaptcha_response, request.remote_addr):
+            _login_failed(limiter_keys)
             flash('Échec de la vérification CAPTCHA.', 'error')
             return redirect(url_for('auth.login'))
 
-        username = request.form['username']
-        password = request.form['password']
         with get_db(current_app) as conn:
             user = conn.execute('SELECT * FROM users WHERE username = ? AND active = 1', (username,)).fetchone()
-        if user and check_password_hash(user['password'], password):
+        valid = user is not None and password_hasher.check(user['password'], password)
+        if valid:
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
+            pwhash = user['password']
+            if password_hasher.needs_rehash(pwhash):
+                # Algorithme ou coût modifié depuis la création du hash
+                pwhash = password_hasher.hash(password)
             with get_db(current_app) as conn:
-                conn.execute('UPDATE users SET last_login = ? WHERE id = ?', (datetime.now().isoformat(), user['id']))
+                conn.execute('UPDATE users SET last_login = ?, password = ? WHERE id = ?', (datetime.now().isoformat(), pwhash, user['id']))
                 conn.commit()
             flash('Connexion réussie !', 'success')
             return redirect(url_for('main.dashboard' if user['role'] == 'admin' else 'main.index'))
+        _login_failed(limiter_keys)
         flash('Nom d’utilisateur ou mot de passe incorrect.', 'error')
     return render_template('login.html')
 
@@ -71,7 +80,7 @@ def register():
         if not recaptcha_response:
             flash('Veuillez compléter le CAPTCHA.', 'error')
             return redirect(url_for('auth.register'))
-        if not verify_recaptcha(recaptcha_response):
+        if not recaptcha.verify(recaptcha_response, request.remote_addr):
             flash('Échec de la vérification CAPTCHA.', 'error')
             return redirect(url_for('auth.register'))
 
@@ -85,10 +94,12 @@ def register():
         if len(password) < 6:
             flash('Le mot de passe doit contenir au moins 6 caractères.', 'error')
             return redirect(url_for('auth.register'))
+        # Hash calculé avant d'emprunter une connexion : l'attente du hasheur ne bloque pas le pool
+        pwhash = password_hasher.hash(password)
         with get_db(current_app) as conn:
             try:
                 conn.execute('INSERT INTO users (username, email, password, role, created_at, active) VALUES (?, ?, ?, ?, ?, ?)',
-                            (username, email, generate_password_hash(password), 'viewer', datetime.now().isoformat(), 1))
+                            (username, email, pwhash, 'viewer', datetime.now().isoformat(), 1))
                 conn.commit()
                 flash('Inscription réussie ! Veuillez vous connecter.', 'success')
                 return redirect(url_for('auth.login'))
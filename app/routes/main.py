@@ -1,16 +1,23 @@
-from flask import Blueprint, render_template, session, current_app, redirect, url_for, flash
+from flask import Blueprint, render_template, session, current_app, redirect, url_for, flash, request, jsonify
 from flask_socketio import emit, join_room, leave_room
 from ..models.user import get_db
-from ..models.analytics import log_viewer_count
+from ..models.analytics import viewer_aggregator, get_totals, get_rollups
+from ..models.sessions import session_registry
+from ..utils.presence import presence
+from ..models.videos import list_videos
+from ..models.access import get_user_access, can_chat, invalidate_user_access
+from ..models.messages import chat_limiter, record_message, get_messages
+from ..models.notifications import user_room, push_notifications, get_user_notifications, get_unread_count
+from ..models.stream_requests import resolve_requests, parse_auto_approve_rules, auto_approves
 from .auth import login_required, admin_required
 from datetime import datetime
 from ..routes.api import stats
-import os
+from ..utils import hls
+from ..utils.metrics import metrics
+from ..utils.sources import LIVE_STREAM_TYPES
 
 main_bp = Blueprint('main', __name__)
 
-connected_users = []
-
 @main_bp.route('/')
 def index():
     return render_template('index.html', stats=stats)
@@ -19,43 +26,47 @@ def index():
 @login_required
 def stream():
     user_id = session['user_id']
+    # Profil et statut de la dernière demande, depuis le cache d'accès
+    access = get_user_access(current_app, user_id)
+    status = access['status'] if access else None
+    if status == 'accepted':
+        # Le spectateur est compté à la connexion du socket (join_stream), pas au rendu de la page
+        live = stats['stream_type'] in LIVE_STREAM_TYPES
+        hls_key = hls.LIVE_KEY if live else hls.vod_key(stats['video_path'] or '')
+        hls_path = hls.playlist_path(current_app.config['HLS_FOLDER'], hls_key)
+        return render_template('stream.html', user=session, stats=stats, hls_path=hls_path, live=live)
+    elif status == 'rejected':
+        flash('Votre demande pour rejoindre le live a été refusée.', 'error')
+        return redirect(url_for('main.index'))
+    elif status is not None:
+        flash('Votre demande pour rejoindre le live est en attente de validation.', 'info')
+        return redirect(url_for('main.index'))
+    if access is None:
+        return redirect(url_for('auth.logout'))
+    rules = parse_auto_approve_rules(current_app.config['STREAM_AUTO_APPROVE'])
+    status = 'accepted' if auto_approves(rules, access) else 'pending'
+    requested_at = datetime.now().isoformat()
     with get_db(current_app) as conn:
-        request = conn.execute('SELECT status FROM stream_requests WHERE user_id = ? ORDER BY requested_at DESC LIMIT 1', (user_id,)).fetchone()
-        if request:
-            if request['status'] == 'accepted':
-                stats['viewers'] += 1
-                stats['total_views'] += 1
-                log_viewer_count(current_app, stats['viewers'])
-                user = conn.execute('SELECT username, email FROM users WHERE id = ?', (user_id,)).fetchone()
-                connected_users.append({'id': user_id, 'username': user['username'], 'email': user['email']})
-                from app import socketio
-                socketio.emit('update_users', connected_users, to=None)
-                return render_template('stream.html', user=session, stats=stats)
-            elif request['status'] == 'rejected':
-                flash('Votre demande pour rejoindre le live a été refusée.', 'error')
-                return redirect(url_for('main.index'))
-            else:
-                flash('Votre demande pour rejoindre le live est en attente de validation.', 'info')
-                return redirect(url_for('main.index'))
-        else:
-            conn.execute('INSERT INTO stream_requests (user_id, status, requested_at) VALUES (?, ?, ?)',
-                        (user_id, 'pending', datetime.now().isoformat()))
-            conn.commit()
-            flash('Votre demande pour rejoindre le live a été envoyée à l\'administrateur.', 'info')
-            user = conn.execute('SELECT username, email FROM users WHERE id = ?', (user_id,)).fetchone()
-            from app import socketio
-            socketio.emit('new_request', {
-                'user_id': user_id,
-                'username': user['username'],
-                'email': user['email'],
-                'requested_at': datetime.now().isoformat()
-            }, to='admin_room')
-            return redirect(url_for('main.index'))
+        conn.execute('INSERT INTO stream_requests (user_id, status, requested_at) VALUES (?, ?, ?)',
+                    (user_id, status, requested_at))
+        conn.commit()
+    invalidate_user_access(user_id)
+    if status == 'accepted':
+        return redirect(url_for('main.stream'))
+    flash('Votre demande pour rejoindre le live a été envoyée à l\'administrateur.', 'info')
+    from app import socketio
+    socketio.emit('new_request', {
+        'user_id': user_id,
+        'username': access['username'],
+        'email': access['email'],
+        'requested_at': requested_at
+    }, to='admin_room')
+    return redirect(url_for('main.index'))
 
 @main_bp.route('/admin')
 @admin_required
 def admin():
-    uploaded_videos = [f for f in os.listdir(current_app.config['UPLOAD_FOLDER']) if f.endswith(('.mp4', '.avi', '.mkv'))]
+    uploaded_videos = [video['filename'] for video in list_videos(current_app)]
     return render_template('admin.html', stats=stats, uploaded_videos=uploaded_videos)
 
 @main_bp.route('/dashboard')
@@ -65,16 +76,23 @@ def dashboard():
         total_users = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
         total_admins = conn.execute('SELECT COUNT(*) FROM users WHERE role = ?', ('admin',)).fetchone()[0]
         recent_logins = conn.execute('SELECT username, last_login, email FROM users ORDER BY last_login DESC LIMIT 5').fetchall()
-        total_watch_time = conn.execute('SELECT SUM(viewers) FROM analytics WHERE type = ?', ('hourly',)).fetchone()[0] or 0
-        notifications = conn.execute('SELECT id, message, created_at, read FROM notifications WHERE user_id = ? ORDER BY created_at DESC', (session['user_id'],)).fetchall()
+    # Première page seulement ; la suite est chargée via /api/notifications
+    page_size = current_app.config['NOTIFICATIONS_PAGE_SIZE']
+    notifications = get_user_notifications(current_app, session['user_id'], limit=page_size)
+    # Agrégats précalculés : coût constant quel que soit l'historique
+    totals = get_totals(current_app)
+    last_hours = get_rollups(current_app, 'hour', 24)
     dashboard_stats = {
         'total_users': total_users,
         'total_admins': total_admins,
         'recent_logins': [(row['username'], row['last_login'], row['email']) for row in recent_logins],
-        'total_watch_time': total_watch_time,
-        'notifications': [{'id': row['id'], 'message': row['message'], 'created_at': row['created_at'], 'read': row['read']} for row in notifications]
+        'total_watch_time': int(totals['watch_seconds'] // 60),
+        'peak_viewers': max((row['max_viewers'] or 0 for row in last_hours), default=0),
+        'notifications': notifications,
+        'notifications_has_more': len(notifications) == page_size,
+        'unread_notifications': get_unread_count(current_app, session['user_id']),
     }
-    return render_template('dashboard.html', user=session, stats=stats, dashboard_stats=dashboard_stats, connected_users=connected_users)
+    return render_template('dashboard.html', user=session, stats=stats, dashboard_stats=dashboard_stats, presence=presence.snapshot())
 
 @main_bp.route('/manage_users')
 @admin_required
@@ -84,73 +102,144 @@ def manage_users():
         requests = conn.execute('SELECT sr.id, sr.user_id, sr.status, sr.requested_at, u.username, u.email FROM stream_requests sr JOIN users u ON sr.user_id = u.id WHERE sr.status = ?', ('pending',)).fetchall()
     return render_template('users.html', users=users, requests=requests)
 
+def _announce_resolved(resolved):
+    """One aggregated event for the admins, then the users' notifications in a batch."""
+    if not resolved:
+        return
+    from app import socketio
+    socketio.emit('requests_updated', {
+        'status': resolved[0]['status'],
+        'requests': [{'request_id': r['request_id'], 'username': r['username'], 'email': r['email']} for r in resolved],
+    }, to='admin_room')
+    push_notifications(current_app, [(r['user_id'], r['notification']) for r in resolved])
+
 @main_bp.route('/manage_request/<int:request_id>/<action>', methods=['POST'])
 @admin_required
 def manage_request(request_id, action):
     if action not in ['accept', 'reject']:
         flash('Action non valide.', 'error')
         return redirect(url_for('main.manage_users'))
-    with get_db(current_app) as conn:
-        request = conn.execute('SELECT user_id, status FROM stream_requests WHERE id = ?', (request_id,)).fetchone()
-        if not request:
-            flash('Demande non trouvée.', 'error')
-            return redirect(url_for('main.manage_users'))
-        if request['status'] != 'pending':
-            flash('Cette demande a déjà été traitée.', 'error')
-            return redirect(url_for('main.manage_users'))
-        user = conn.execute('SELECT username, email FROM users WHERE id = ?', (request['user_id'],)).fetchone()
-        conn.execute('UPDATE stream_requests SET status = ? WHERE id = ?', (action + 'ed', request_id))
-        conn.execute('INSERT INTO notifications (user_id, message, created_at, read) VALUES (?, ?, ?, ?)',
-                    (request['user_id'], f'Votre demande pour rejoindre le live a été { "acceptée" if action == "accept" else "refusée" }.',
-                     datetime.now().isoformat(), 0))
-        conn.commit()
-        flash(f'Demande de {user["username"]} {action + "ée"}.', 'success')
-        from app import socketio
-        socketio.emit('request_updated', {
-            'request_id': request_id,
-            'status': action + 'ed',
-            'username': user['username'],
-            'email': user['email']
-        }, to='admin_room')
+    resolved = resolve_requests(current_app, action, [request_id])
+    if not resolved:
+        with get_db(current_app) as conn:
+            exists = conn.execute('SELECT 1 FROM stream_requests WHERE id = ?', (request_id,)).fetchone()
+        flash('Cette demande a déjà été traitée.' if exists else 'Demande non trouvée.', 'error')
+        return redirect(url_for('main.manage_users'))
+    flash(f'Demande de {resolved[0]["username"]} {action + "ée"}.', 'success')
+    _announce_resolved(resolved)
+    return redirect(url_for('main.manage_users'))
+
+@main_bp.route('/manage_requests', methods=['POST'])
+@admin_required
+def manage_requests():
+    """Bulk accept/reject: the selected request_ids, or every pending request with scope=all."""
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(data, dict) and request.is_json:
+        return jsonify({'error': 'Corps JSON non valide'}), 400
+    action = data.get('action')
+    if action not in ['accept', 'reject']:
+        if request.is_json:
+            return jsonify({'error': 'Action non valide'}), 400
+        flash('Action non valide.', 'error')
+        return redirect(url_for('main.manage_users'))
+    if data.get('scope') == 'all':
+        request_ids = None
+    else:
+        ids = data.get('request_ids', []) if request.is_json else request.form.getlist('request_ids')
+        if not isinstance(ids, list):
+            return jsonify({'error': 'request_ids doit être une liste'}), 400
+        request_ids = [int(i) for i in ids if str(i).isdigit()]
+    resolved = resolve_requests(current_app, action, request_ids) if request_ids is None or request_ids else []
+    _announce_resolved(resolved)
+    if request.is_json:
+        return jsonify({'status': action + 'ed', 'count': len(resolved)}), 200
+    flash(f'{len(resolved)} demande(s) {"acceptée(s)" if action == "accept" else "refusée(s)"}.', 'success' if resolved else 'info')
     return redirect(url_for('main.manage_users'))
 
 from app import socketio
 
+connected_clients = metrics.gauge('socketio_clients', 'Socket.IO clients connected to this worker')
+
 @socketio.on('connect')
 def handle_connect():
+    connected_clients.inc()
     if session.get('role') == 'admin':
         join_room('admin_room')
     if session.get('user_id'):
+        join_room(user_room(session['user_id']))
         join_room('stream_room')
 
+def _on_sessions_expired(user_ids):
+    stats['viewers'] = session_registry.viewer_count()
+    for user_id in user_ids:
+        presence.left(user_id)
+
+session_registry.on_expire = _on_sessions_expired
+
+@socketio.on('subscribe_presence')
+def handle_subscribe_presence():
+    if session.get('user_id'):
+        join_room(presence.room)
+
+def _join_stream(resumed=False):
+    if 'user_id' not in session or not stats['stream_active']:
+        return
+    access = get_user_access(current_app, session['user_id'])
+    if not can_chat(access):
+        return
+    if session_registry.join(request.sid, session['user_id'], access['username'], access['email']):
+        # Premier onglet ouvert par cet utilisateur : une vue de plus, sauf reprise d'une session expirée
+        if not resumed:
+            stats.incr('total_views')
+            viewer_aggregator.record_join()
+        stats['viewers'] = session_registry.viewer_count()
+        presence.joined({'id': access['user_id'], 'username': access['username'], 'email': access['email']})
+
+@socketio.on('join_stream')
+def handle_join_stream():
+    # Seule la page du stream envoie join_stream : les autres sockets ne reçoivent pas l'historique
+    if 'user_id' in session and can_chat(get_user_access(current_app, session['user_id'])):
+        limit = current_app.config['CHAT_JOIN_HISTORY']
+        history = get_messages(current_app, limit=limit)
+        emit('chat_history', {'messages': list(reversed(history)), 'has_more': len(history) == limit})
+    _join_stream()
+
+@socketio.on('heartbeat')
+def handle_heartbeat():
+    if not session_registry.heartbeat(request.sid):
+        # Session expirée alors que le socket est toujours là (onglet en arrière-plan, timers ralentis) : on la rouvre
+        _join_stream(resumed=True)
+
 @socketio.on('disconnect')
 def handle_disconnect():
+    connected_clients.dec()
     if session.get('user_id'):
-        user_id = session['user_id']
-        global connected_users
-        connected_users = [u for u in connected_users if u['id'] != user_id]
         if session.get('role') == 'admin':
             leave_room('admin_room')
         leave_room('stream_room')
-        socketio.emit('update_users', connected_users, to=None)
+        user_id = session_registry.leave(request.sid)
+        if user_id is not None:
+            stats['viewers'] = session_registry.viewer_count()
+            presence.left(user_id)
 
 @socketio.on('send_message')
 def handle_message(data):
     if 'user_id' not in session:
         return
     user_id = session['user_id']
-    with get_db(current_app) as conn:
-        request = conn.execute('SELECT status FROM stream_requests WHERE user_id = ? ORDER BY requested_at DESC LIMIT 1', (user_id,)).fetchone()
-        if not request or request['status'] != 'accepted':
-            return
-        message = data['message']
-        if message.strip():
-            conn.execute('INSERT INTO messages (user_id, message, created_at) VALUES (?, ?, ?)',
-                        (user_id, message, datetime.now().isoformat()))
-            conn.commit()
-            user = conn.execute('SELECT username FROM users WHERE id = ?', (user_id,)).fetchone()
-            socketio.emit('new_message', {
-                'username': user['username'],
-                'message': message,
-                'created_at': datetime.now().isoformat()
-            }, to='stream_room')
\ No newline at end of file
+    # Statut et profil viennent du cache : aucune lecture en base par message en régime établi
+    access = get_user_access(current_app, user_id)
+    if not can_chat(access):
+        return
+    message = data.get('message') if isinstance(data, dict) else None
+    if not isinstance(message, str) or not message.strip():
+        return
+    if len(message) > current_app.config['CHAT_MAX_MESSAGE_LENGTH']:
+        emit('chat_error', {'error': 'Message trop long.'})
+        return
+    if not chat_limiter.allow(user_id):
+        emit('chat_error', {'error': 'Vous envoyez des messages trop rapidement.'})
+        return
+    # Diffusion immédiate, écriture en base par lots
+    entry = record_message(user_id, access['username'], message, datetime.now().isoformat())
+    socketio.emit('new_message', entry, to='stream_room')
\ No newline at end of file
@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters."""
+
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        # Nombre d'invalidations par clé (et de vidages complets) : une lecture commencée avant ne doit pas être stockée
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, maxsize, ttl):
+        with self.lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            self.data.clear()
+            self.epoch += 1
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is _MISSING or entry[0] < now:
+                if entry is not _MISSING:
+                    del self.data[key]
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, key):
+        """Token to take before loading key from the source, then pass to set()."""
+        with self.lock:
+            return (self.epoch, self.generations.get(key, 0))
+
+    def set(self, key, value, generation=None):
+        """Store value; with a generation token, skipped if key was invalidated since the token was taken."""
+        with self.lock:
+            if generation is not None and generation != (self.epoch, self.generations.get(key, 0)):
+                return False
+            self.data[key] = (time.monotonic() + self.ttl, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.epoch += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
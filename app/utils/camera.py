@@ -1,80 +1,440 @@
+from abc import ABC, abstractmethod
 import cv2
 import logging
+import numpy as np
 import os
+import queue
+import threading
+import time
 from datetime import datetime
+from .concurrency import blocking
+from .metrics import metrics
+from .sources import WebcamSource
+
+capture_seconds = metrics.histogram('camera_capture_seconds', 'Time to read one frame from the source')
+detect_seconds = metrics.histogram('camera_change_detection_seconds', 'Time to compare a frame with the last one sent')
+encode_seconds = metrics.histogram('camera_encode_seconds', 'JPEG encoding time, by rendition', ['rendition'])
+frames_sent = metrics.counter('stream_frames_sent_total', 'Frames written to MJPEG viewers, by rendition', ['rendition'])
+
+class FrameSink(ABC):
+    """Consumes raw capture frames on its own thread through a bounded queue."""
+
+    def __init__(self, name, max_queue=60, drop_policy='oldest'):
+        if drop_policy not in ('oldest', 'newest'):
+            raise ValueError(f"Politique de rejet inconnue : {drop_policy}")
+        self.drop_policy = drop_policy
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.failed = False
+        self.thread = threading.Thread(target=self._write_loop, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame):
+        # Ne bloque jamais la boucle de capture : en cas de consommateur lent, on jette des frames
+        try:
+            self.queue.put_nowait(frame)
+            return
+        except queue.Full:
+            pass
+        if self.drop_policy == 'oldest':
+            try:
+                self.queue.get_nowait()
+                self.frames_dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(frame)
+                return
+            except queue.Full:
+                pass
+        self.frames_dropped += 1
+
+    def _write_loop(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            if self.failed:
+                # On continue de vider la file pour que stop() ne bloque jamais
+                self.frames_dropped += 1
+                continue
+            try:
+                blocking(self.write, frame)
+                self.frames_written += 1
+            except Exception as e:
+                logging.error(f"Erreur d'écriture du frame ({self.thread.name}) : {str(e)}")
+                self.failed = True
+
+    @abstractmethod
+    def write(self, frame):
+        pass
+
+    def close(self):
+        pass
+
+    def stop(self):
+        # Le marqueur de fin passe après les frames déjà en file, qui sont donc écrits
+        self.queue.put(None)
+        self.thread.join()
+        self.close()
+
+    def stats(self):
+        return {
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'queue_size': self.queue.qsize(),
+        }
+
+class Recorder(FrameSink):
+    def __init__(self, filepath, fps, frame_size, **kwargs):
+        self.filepath = filepath
+        self.writer = cv2.VideoWriter(filepath, cv2.VideoWriter_fourcc(*'mp4v'), fps, frame_size)
+        super().__init__('camera-recorder', **kwargs)
+
+    def write(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+    def stats(self):
+        stats = super().stats()
+        stats['file'] = os.path.basename(self.filepath)
+        return stats
+
+class ChangeDetector:
+    """Compares a downsampled grayscale frame, block by block, with the last frame sent."""
+
+    def __init__(self, threshold=4.0, block_size=8, width=160):
+        self.threshold = threshold
+        self.block_size = block_size
+        self.width = width - width % block_size
+        self.reference = None
+        self.candidate = None
+
+    def _thumbnail(self, frame):
+        height = max(int(frame.shape[0] * self.width / frame.shape[1]) // self.block_size, 1) * self.block_size
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def changed(self, frame):
+        """True if any block's mean difference exceeds the threshold; call commit() once the frame is sent."""
+        if self.threshold <= 0:
+            return True
+        self.candidate = self._thumbnail(frame)
+        if self.reference is None or self.reference.shape != self.candidate.shape:
+            return True
+        rows, columns = self.candidate.shape
+        size = self.block_size
+        # Moyenne de l'écart absolu par bloc : le bruit du capteur s'efface, un mouvement localisé reste visible
+        diff = np.abs(self.candidate - self.reference)
+        blocks = diff.reshape(rows // size, size, columns // size, size).mean(axis=(1, 3))
+        return bool((blocks > self.threshold).any())
+
+    def commit(self):
+        if self.candidate is not None:
+            self.reference = self.candidate
+
+    def reset(self):
+        self.reference = None
+        self.candidate = None
+
+class FramePacer:
+    """Lets frames through at a target rate; 0 keeps the source rate."""
+
+    def __init__(self, fps=0):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.next_due = 0.0
+
+    def ready(self, now):
+        if not self.interval:
+            return True
+        if now < self.next_due:
+            return False
+        # Après un retard (source lente), on repart de maintenant au lieu de rattraper en rafale
+        if now - self.next_due > self.interval:
+            self.next_due = now + self.interval
+        else:
+            self.next_due += self.interval
+        return True
 
 class Camera:
     _instance = None
+    # Rendus disponibles : (largeur max en pixels, qualité JPEG)
+    RENDITIONS = {
+        'low': (320, 50),
+        'med': (640, 70),
+        'high': (None, 95),
+    }
+    DEFAULT_RENDITION = 'high'
+    COUNTERS = ('frames_captured', 'frames_paced', 'frames_skipped', 'frames_encoded', 'keepalives', 'bytes_encoded')
 
     def __init__(self):
         if Camera._instance is not None:
             raise Exception("Cette classe est un singleton !")
         Camera._instance = self
-        self.video = None
+        self.source = None
         self.recording = False
-        self.out = None
+        self.recorder = None
+        self.sinks = []
         self.upload_folder = None
+        # Dernier frame encodé par rendu, partagé par tous les spectateurs
+        self.condition = threading.Condition()
+        self.frames = {}
+        self.viewers = {name: 0 for name in self.RENDITIONS}
+        self.sequence = 0
+        self.running = False
+        self.thread = None
+        # Points d'extension pour le partage entre workers (voir camera_control)
+        self.demand = None
+        self.on_frames = None
+        self.on_viewer_change = None
+        self.relaying = False
+        # Frames transmis au plus à target_fps ; une scène inchangée n'est renvoyée que toutes les keepalive secondes
+        self.pacer = FramePacer()
+        self.detector = ChangeDetector()
+        self.keepalive = 2.0
+        self.last_sent = 0.0
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
         logging.info("Camera instance created")
 
+    def configure(self, target_fps=0, keepalive=2.0, change_threshold=4.0, block_size=8):
+        self.pacer = FramePacer(target_fps)
+        self.detector = ChangeDetector(change_threshold, block_size)
+        self.keepalive = keepalive
+
     @staticmethod
     def get_instance():
         if Camera._instance is None:
             Camera()
         return Camera._instance
 
-    def start(self, upload_folder=None):
-        if self.video is None:
-            self.video = cv2.VideoCapture(0)
-            if not self.video.isOpened():
-                logging.error("Impossible d'ouvrir la webcam")
-                raise Exception("Impossible d'ouvrir la webcam")
+    def start(self, upload_folder=None, source=None):
+        """Start the capture loop on a FrameSource, the default webcam if none is given."""
+        if self.source is None:
+            source = source if source is not None else WebcamSource()
+            try:
+                source.open()
+            except Exception as e:
+                logging.error(f"Impossible d'ouvrir la source {source.describe()} : {str(e)}")
+                raise
+            self.source = source
             self.upload_folder = upload_folder
-            logging.info("Webcam démarrée")
-        return self.video.isOpened()
+            self.relaying = False
+            self.running = True
+            self.detector.reset()
+            self.last_sent = 0.0
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+            self.thread = threading.Thread(target=self._capture_loop, name='camera-capture', daemon=True)
+            self.thread.start()
+            logging.info(f"Source démarrée : {self.source.describe()}")
+        return self.source.is_open()
 
     def start_recording(self):
-        if self.video is None or not self.video.isOpened():
+        if self.source is None or not self.source.is_open():
             return False
         if not self.recording and self.upload_folder:
             filename = f"recording_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4"
             filepath = os.path.join(self.upload_folder, filename)
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            fps = 20.0
-            frame_size = (int(self.video.get(3)), int(self.video.get(4)))
-            self.out = cv2.VideoWriter(filepath, fourcc, fps, frame_size)
+            fps = self.fps()
+            self.recorder = Recorder(filepath, fps, self.frame_size())
+            self.add_sink(self.recorder)
             self.recording = True
             logging.info(f"Enregistrement démarré : {filepath}")
             return True
         return False
 
     def stop_recording(self):
-        if self.recording and self.out is not None:
-            self.out.release()
+        if self.recording and self.recorder is not None:
+            recorder = self.recorder
             self.recording = False
-            self.out = None
-            logging.info("Enregistrement arrêté")
-        return True
+            self.recorder = None
+            self.remove_sink(recorder)
+            stats = recorder.stats()
+            logging.info(f"Enregistrement arrêté : {stats}")
+            return stats
+        return None
+
+    def add_sink(self, sink):
+        with self.condition:
+            self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        with self.condition:
+            self.sinks = [s for s in self.sinks if s is not sink]
+        sink.stop()
+
+    def frame_size(self):
+        if self.source is None:
+            return None
+        return self.source.frame_size()
+
+    def fps(self):
+        if self.source is None:
+            return None
+        return self.source.fps()
+
+    def capture_stats(self):
+        stats = dict(self.counters)
+        paced = stats['frames_captured'] - stats['frames_paced']
+        stats['skip_ratio'] = round(stats['frames_skipped'] / paced, 3) if paced else 0.0
+        return stats
+
+    def recording_stats(self):
+        recorder = self.recorder
+        if recorder is None:
+            return None
+        return recorder.stats()
 
     def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2.0)
+        self.thread = None
         self.stop_recording()
-        if self.video is not None:
-            self.video.release()
-            self.video = None
-            logging.info("Webcam arrêtée")
-
-    def gen_frames(self):
-        while self.video is not None and self.video.isOpened():
-            success, frame = self.video.read()
+        for sink in list(self.sinks):
+            self.remove_sink(sink)
+        if self.source is not None:
+            source = self.source
+            self.source = None
+            source.close()
+            logging.info(f"Source arrêtée : {source.describe()}")
+
+    def _capture_loop(self):
+        # Une seule boucle de capture et d'encodage, quel que soit le nombre de spectateurs
+        counters = self.counters
+        source = self.source
+        while self.running and source.is_open():
+            # Les sources sans horloge propre (fichier, mire) sont cadencées ici, hors du pool de threads
+            source.wait()
+            start = time.perf_counter()
+            success, frame = blocking(source.read)
+            capture_seconds.observe(time.perf_counter() - start)
             if not success:
                 logging.error("Erreur : impossible de lire le frame")
                 break
-            if self.recording and self.out is not None:
-                self.out.write(frame)
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                logging.error("Erreur : impossible d'encoder le frame")
+            counters['frames_captured'] += 1
+            # L'enregistrement reçoit tous les frames, indépendamment du rythme de diffusion
+            for sink in self.sinks:
+                sink.submit(frame)
+            now = time.monotonic()
+            if not self.pacer.ready(now):
+                counters['frames_paced'] += 1
                 continue
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        self.stop()
\ No newline at end of file
+            if self.demand is not None:
+                active = self.demand()
+            else:
+                with self.condition:
+                    active = [name for name, count in self.viewers.items() if count > 0]
+            if active:
+                start = time.perf_counter()
+                changed = blocking(self.detector.changed, frame)
+                detect_seconds.observe(time.perf_counter() - start)
+                # Un rendu qui vient d'être demandé reçoit tout de suite une image, même sur une scène figée
+                missing = any(name not in self.frames for name in active)
+                if not changed and not missing:
+                    if now - self.last_sent < self.keepalive:
+                        counters['frames_skipped'] += 1
+                        continue
+                    counters['keepalives'] += 1
+            # Chaque rendu regardé est encodé une seule fois par frame
+            encoded = {}
+            for name in active:
+                start = time.perf_counter()
+                buffer = blocking(self._encode, frame, *self.RENDITIONS[name])
+                encode_seconds.labels(name).observe(time.perf_counter() - start)
+                if buffer is not None:
+                    encoded[name] = buffer
+                    counters['bytes_encoded'] += len(buffer)
+            if encoded:
+                self.detector.commit()
+                self.last_sent = now
+                counters['frames_encoded'] += 1
+            with self.condition:
+                self.sequence += 1
+                for name, buffer in encoded.items():
+                    self.frames[name] = (self.sequence, buffer)
+                for name in self.RENDITIONS:
+                    if name not in encoded and self.viewers[name] == 0:
+                        self.frames.pop(name, None)
+                sequence = self.sequence
+                self.condition.notify_all()
+            if self.on_frames is not None and encoded:
+                self.on_frames(sequence, encoded)
+        if self.running:
+            self.stop()
+
+    def attach_relay(self):
+        """Serve frames captured by another worker, fed through relay_frame()."""
+        with self.condition:
+            if self.source is None:
+                self.relaying = True
+                self.running = True
+
+    def relay_frame(self, rendition, sequence, frame):
+        with self.condition:
+            if not self.relaying or rendition not in self.RENDITIONS:
+                return
+            self.frames[rendition] = (sequence, frame)
+            self.condition.notify_all()
+
+    def detach_relay(self):
+        with self.condition:
+            if self.relaying:
+                self.relaying = False
+                self.running = False
+                self.frames = {}
+                self.condition.notify_all()
+
+    def _encode(self, frame, width, quality):
+        if width is not None and frame.shape[1] > width:
+            height = int(frame.shape[0] * width / frame.shape[1])
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ret:
+            logging.error("Erreur : impossible d'encoder le frame")
+            return None
+        return buffer.tobytes()
+
+    def gen_frames(self, rendition=DEFAULT_RENDITION):
+        # Chaque spectateur ne reçoit que le frame le plus récent : un client lent
+        # saute des frames au lieu de bloquer la capture
+        with self.condition:
+            self.viewers[rendition] += 1
+        if self.on_viewer_change is not None:
+            self.on_viewer_change(rendition, 1)
+        sent = frames_sent.labels(rendition)
+        try:
+            last_sequence = 0
+            while True:
+                with self.condition:
+                    while self.running and self.frames.get(rendition, (0, None))[0] <= last_sequence:
+                        self.condition.wait(timeout=1.0)
+                    if not self.running:
+                        break
+                    last_sequence, frame = self.frames[rendition]
+                sent.inc()
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        finally:
+            with self.condition:
+                self.viewers[rendition] -= 1
+            if self.on_viewer_change is not None:
+                self.on_viewer_change(rendition, -1)
+
+def _camera():
+    return Camera.get_instance()
+
+metrics.counter('camera_frames_total', 'Frames seen by the capture loop, by outcome', ['outcome'],
+                fn=lambda: {name.replace('frames_', ''): value for name, value in _camera().counters.items()
+                            if name != 'bytes_encoded'})
+metrics.counter('camera_encoded_bytes_total', 'JPEG bytes produced by the capture loop',
+                fn=lambda: _camera().counters['bytes_encoded'])
+metrics.gauge('stream_viewers', 'MJPEG viewers connected to this worker, by rendition', ['rendition'],
+              fn=lambda: dict(_camera().viewers))
+metrics.gauge('camera_sink_queue_depth', 'Frames waiting in each sink queue (recording, HLS)', ['sink'],
+              fn=lambda: {sink.thread.name: sink.queue.qsize() for sink in _camera().sinks})
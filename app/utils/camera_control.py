@@ -0,0 +1,186 @@
+import atexit
+import logging
+import threading
+import time
+from .camera import Camera
+from .ingest import probe_worker
+from .state import state, decode, WORKER_ID
+
+LOCK_NAME = 'camera'
+
+class CameraController:
+    """Routes camera commands to the worker that owns the webcam.
+
+    A single worker holds the 'camera' lock and runs the capture loop. With a
+    shared backend it publishes its encoded frames, and the other workers
+    serve them to their own viewers through Camera.attach_relay().
+    """
+
+    def __init__(self):
+        self.camera = Camera.get_instance()
+        self.owner = False
+        self.lock_ttl = 10.0
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.demand_cache = (0.0, [])
+
+    def init_app(self, app):
+        config = app.config
+        self.lock_ttl = config['CAMERA_LOCK_TTL']
+        self.camera.configure(target_fps=config['CAMERA_TARGET_FPS'], keepalive=config['CAMERA_KEEPALIVE'],
+                              change_threshold=config['CAMERA_CHANGE_THRESHOLD'],
+                              block_size=config['CAMERA_CHANGE_BLOCK'])
+        state.subscribe('camera', self._on_command)
+        if state.shared:
+            state.subscribe('frames', self._on_frame)
+            self.camera.demand = self._demand
+            self.camera.on_viewer_change = lambda rendition, delta: state.hincr('renditions', rendition, delta)
+            if state.get('camera:owner') is not None:
+                self.camera.attach_relay()
+        atexit.register(self.shutdown)
+
+    @property
+    def recording(self):
+        return bool(state.get('camera:recording', False))
+
+    def recording_stats(self):
+        if self.owner:
+            return self.camera.recording_stats()
+        return state.get('camera:recording_stats')
+
+    def capture_stats(self):
+        if self.owner:
+            return self.camera.capture_stats()
+        return state.get('camera:capture_stats')
+
+    def start(self, upload_folder, source=None):
+        if not state.acquire_lock(LOCK_NAME, WORKER_ID, self.lock_ttl):
+            raise Exception("La webcam est déjà utilisée par un autre worker")
+        self.camera.detach_relay()
+        try:
+            self.camera.start(upload_folder=upload_folder, source=source)
+        except Exception:
+            state.release_lock(LOCK_NAME, WORKER_ID)
+            raise
+        self.owner = True
+        if state.shared:
+            self.camera.on_frames = self._publish_frames
+        state.set('camera:owner', WORKER_ID)
+        state.set('camera:recording', False)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._keepalive, name='camera-lock', daemon=True)
+        self.thread.start()
+        state.publish('camera', {'action': 'started', 'owner': WORKER_ID})
+        return self.camera
+
+    def stop(self):
+        """Stop the webcam wherever it runs."""
+        if self.owner:
+            self._stop_local()
+        elif state.shared:
+            state.publish('camera', {'action': 'stop'})
+
+    def shutdown(self):
+        """Release the webcam held by this worker and end its MJPEG streams."""
+        if self.owner:
+            self._stop_local()
+        self.camera.detach_relay()
+
+    def start_recording(self):
+        if self.owner:
+            started = self.camera.start_recording()
+            if started:
+                state.set('camera:recording', True)
+            return started
+        if state.get('camera:owner') is None:
+            return False
+        state.publish('camera', {'action': 'start_recording'})
+        return True
+
+    def stop_recording(self):
+        if self.owner:
+            return self._stop_recording_local()
+        state.publish('camera', {'action': 'stop_recording'})
+        return True
+
+    def _stop_recording_local(self):
+        recording = self.camera.stop_recording()
+        state.set('camera:recording', False)
+        state.set('camera:recording_stats', None)
+        if recording is not None:
+            probe_worker.register(recording['file'])
+        return recording
+
+    def _stop_local(self, lock_lost=False):
+        self.owner = False
+        self.stop_event.set()
+        recording = self.camera.recording_stats()
+        self.camera.on_frames = None
+        self.camera.stop()
+        if recording is not None:
+            probe_worker.register(recording['file'])
+        if lock_lost:
+            # L'état partagé appartient désormais au nouveau détenteur : on n'y touche pas
+            if state.shared and state.get('camera:owner') not in (None, WORKER_ID):
+                self.camera.attach_relay()
+            return
+        state.set('camera:owner', None)
+        state.set('camera:recording', False)
+        state.set('camera:recording_stats', None)
+        state.set('camera:capture_stats', None)
+        state.release_lock(LOCK_NAME, WORKER_ID)
+        state.publish('camera', {'action': 'stopped', 'owner': WORKER_ID})
+
+    def _keepalive(self):
+        # Le verrou expire si ce worker meurt : un autre pourra reprendre la webcam
+        while not self.stop_event.wait(self.lock_ttl / 3):
+            if not self.camera.running:
+                logging.warning("Boucle de capture arrêtée, libération de la webcam")
+                self._stop_local()
+                return
+            if not state.acquire_lock(LOCK_NAME, WORKER_ID, self.lock_ttl):
+                # Un autre worker a pu prendre la webcam : deux boucles de capture ne doivent pas coexister
+                logging.error("Verrou de la webcam perdu, arrêt de la capture")
+                self._stop_local(lock_lost=True)
+                return
+            if self.camera.recording:
+                state.set('camera:recording_stats', self.camera.recording_stats())
+            if state.shared:
+                state.set('camera:capture_stats', self.camera.capture_stats())
+
+    def _on_command(self, message):
+        message = decode(message)
+        action = message['action']
+        if action == 'started' and message['owner'] != WORKER_ID:
+            self.camera.attach_relay()
+        elif action == 'stopped' and message['owner'] != WORKER_ID:
+            self.camera.detach_relay()
+        elif not self.owner:
+            return
+        elif action == 'stop':
+            self._stop_local()
+        elif action == 'start_recording':
+            self.start_recording()
+        elif action == 'stop_recording':
+            self._stop_recording_local()
+
+    def _publish_frames(self, sequence, encoded):
+        for rendition, frame in encoded.items():
+            state.publish('frames', f"{rendition}:{sequence}:".encode() + frame)
+
+    def _on_frame(self, message):
+        if self.owner:
+            return
+        rendition, sequence, frame = message.split(b':', 2)
+        self.camera.relay_frame(rendition.decode(), int(sequence), frame)
+
+    def _demand(self):
+        # Rendus regardés sur l'ensemble des workers, relus au plus deux fois par seconde
+        fetched_at, active = self.demand_cache
+        now = time.monotonic()
+        if now - fetched_at > 0.5:
+            active = [name for name, count in state.hgetall('renditions').items() if count > 0]
+            self.demand_cache = (now, active)
+        return active
+
+camera_control = CameraController()
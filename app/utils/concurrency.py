@@ -0,0 +1,29 @@
+import sys
+
+def _detect():
+    # Le serveur de production applique le monkey patching avant d'importer l'application
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return 'eventlet'
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return 'gevent'
+    return 'threading'
+
+MODE = _detect()
+
+def blocking(fn, *args, **kwargs):
+    """Run a call that blocks in C code (OpenCV, SQLite) without stalling the event loop.
+
+    Under eventlet or gevent the call goes to their native thread pool; with
+    regular threads it is simply called.
+    """
+    if MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args, **kwargs)
+    if MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args, kwargs)
+    return fn(*args, **kwargs)
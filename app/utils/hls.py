@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import cv2
+from .camera import FrameSink
+
+LIVE_KEY = 'live'
+PLAYLIST = 'index.m3u8'
+
+_vod_jobs = set()
+_vod_lock = threading.Lock()
+
+def ffmpeg_binary():
+    """Return the path of the local ffmpeg binary, or None when it is not installed."""
+    return shutil.which(os.getenv('FFMPEG_BINARY', 'ffmpeg'))
+
+def vod_key(name):
+    """Directory name holding the HLS rendition of an uploaded video."""
+    return 'vod_' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+def playlist_path(hls_folder, key):
+    """Playlist path relative to the HLS folder, or None if it has not been produced yet."""
+    if os.path.isfile(os.path.join(hls_folder, key, PLAYLIST)):
+        return f"{key}/{PLAYLIST}"
+    return None
+
+def _hls_args(output_dir, segment_seconds):
+    return ['-f', 'hls', '-hls_time', str(segment_seconds),
+            '-hls_segment_filename', os.path.join(output_dir, 'segment_%05d.ts'),
+            os.path.join(output_dir, PLAYLIST)]
+
+class LiveSegmenter(FrameSink):
+    """Pipes raw capture frames into ffmpeg, which keeps a rolling window of HLS segments."""
+
+    def __init__(self, output_dir, fps, frame_size, segment_seconds=4, list_size=6, **kwargs):
+        binary = ffmpeg_binary()
+        if binary is None:
+            raise RuntimeError("ffmpeg introuvable")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir, exist_ok=True)
+        self.frame_size = frame_size
+        gop = max(1, int(round(fps * segment_seconds)))
+        cmd = [binary, '-loglevel', 'error', '-y',
+               '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f"{frame_size[0]}x{frame_size[1]}",
+               '-r', str(fps), '-use_wallclock_as_timestamps', '1', '-i', '-',
+               '-c:v', 'libx264', '-preset', 'veryfast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p',
+               '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+               '-hls_list_size', str(list_size), '-hls_flags', 'delete_segments+omit_endlist'
+               ] + _hls_args(output_dir, segment_seconds)
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+        super().__init__('hls-live', **kwargs)
+
+    def write(self, frame):
+        if (frame.shape[1], frame.shape[0]) != self.frame_size:
+            frame = cv2.resize(frame, self.frame_size)
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+def start_live(camera, hls_folder, segment_seconds=4, list_size=6):
+    """Attach a live HLS segmenter to the running camera capture loop."""
+    segmenter = LiveSegmenter(os.path.join(hls_folder, LIVE_KEY), camera.fps(), camera.frame_size(),
+                              segment_seconds=segment_seconds, list_size=list_size)
+    camera.add_sink(segmenter)
+    logging.info("Segmentation HLS live démarrée")
+    return segmenter
+
+def segment_video(source, hls_folder, segment_seconds=4):
+    """Segment an uploaded video once, in the background. Returns False if ffmpeg is missing."""
+    binary = ffmpeg_binary()
+    if binary is None:
+        return False
+    key = vod_key(os.path.basename(source))
+    if playlist_path(hls_folder, key) is not None:
+        return True
+    with _vod_lock:
+        if key in _vod_jobs:
+            return True
+        _vod_jobs.add(key)
+    threading.Thread(target=_segment_video, args=(binary, source, hls_folder, key, segment_seconds),
+                     name=f"hls-{key}", daemon=True).start()
+    return True
+
+def _segment_video(binary, source, hls_folder, key, segment_seconds):
+    # On écrit dans un dossier temporaire puis on le renomme : la playlist
+    # n'est visible qu'une fois complète
+    output_dir = os.path.join(hls_folder, key)
+    tmp_dir = output_dir + '.tmp'
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        cmd = [binary, '-loglevel', 'error', '-y', '-i', source,
+               '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p',
+               '-force_key_frames', f"expr:gte(t,n_forced*{segment_seconds})",
+               '-c:a', 'aac', '-hls_playlist_type', 'vod'] + _hls_args(tmp_dir, segment_seconds)
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            logging.error(f"Échec de la segmentation HLS de {source} : {result.stderr.decode(errors='replace')}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        # Les chemins de segments de la playlist sont relatifs, le renommage ne les casse pas
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(tmp_dir, output_dir)
+        logging.info(f"Segmentation HLS terminée : {source}")
+    finally:
+        with _vod_lock:
+            _vod_jobs.discard(key)
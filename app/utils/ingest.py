@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+import queue
+import tempfile
+import threading
+import cv2
+from .metrics import metrics
+from ..models.videos import VIDEO_EXTENSIONS, create_video, update_video_metadata, unregistered_files
+from .thumbnails import thumbnail_cache
+
+CHUNK_SIZE = 1024 * 1024
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def _looks_like_video(head, filename):
+    # Vérifie la signature du conteneur, pas seulement l'extension
+    if filename.endswith('.mp4'):
+        return head[4:8] == b'ftyp'
+    if filename.endswith('.mkv'):
+        return head[:4] == b'\x1a\x45\xdf\xa3'
+    if filename.endswith('.avi'):
+        return head[:4] == b'RIFF' and head[8:12] == b'AVI '
+    return False
+
+def save_stream(stream, folder, filename, max_size):
+    """Write an upload to disk chunk by chunk, hashing it on the way, then rename it into place."""
+    if not filename.endswith(VIDEO_EXTENSIONS):
+        raise UploadError('Format de fichier non supporté')
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.upload_', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            head = b''
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < 12:
+                    head += chunk[:12 - len(head)]
+                size += len(chunk)
+                if size > max_size:
+                    raise UploadError('Fichier trop volumineux', status=413)
+                digest.update(chunk)
+                tmp.write(chunk)
+        if size == 0:
+            raise UploadError('Fichier vide')
+        if not _looks_like_video(head, filename):
+            raise UploadError('Le fichier ne correspond pas à son extension')
+        os.replace(tmp_path, os.path.join(folder, filename))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {'filename': filename, 'size': size, 'sha256': digest.hexdigest()}
+
+def probe_video(path):
+    """Read duration, resolution, fps and codec from a video file with OpenCV."""
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return {'status': 'invalid'}
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0
+        fourcc = int(capture.get(cv2.CAP_PROP_FOURCC))
+        codec = ''.join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip('\x00 ') or None
+        return {
+            'status': 'ready',
+            'duration': frame_count / fps if fps > 0 else None,
+            'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': fps or None,
+            'codec': codec,
+        }
+    finally:
+        capture.release()
+
+class ProbeWorker:
+    """Background thread probing newly ingested videos and storing their metadata."""
+
+    def __init__(self):
+        self.app = None
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='video-probe', daemon=True)
+            self.thread.start()
+        # Enregistre les fichiers déjà présents (uploads antérieurs, copies manuelles)
+        folder = app.config['UPLOAD_FOLDER']
+        on_disk = [f for f in os.listdir(folder) if f.endswith(VIDEO_EXTENSIONS)]
+        for filename in unregistered_files(app, on_disk):
+            self.register(filename)
+
+    def register(self, filename, size=None, sha256=None):
+        path = os.path.join(self.app.config['UPLOAD_FOLDER'], filename)
+        if size is None:
+            size = os.path.getsize(path)
+        create_video(self.app, filename, size, sha256)
+        self.queue.put(filename)
+
+    def _run(self):
+        while True:
+            filename = self.queue.get()
+            try:
+                metadata = probe_video(os.path.join(self.app.config['UPLOAD_FOLDER'], filename))
+                update_video_metadata(self.app, filename, metadata)
+                if metadata['status'] == 'ready':
+                    thumbnail_cache.warm(filename)
+                logging.info(f"Vidéo analysée : {filename} ({metadata['status']})")
+            except Exception as e:
+                logging.error(f"Erreur lors de l'analyse de {filename} : {str(e)}")
+
+probe_worker = ProbeWorker()
+
+metrics.gauge('video_probe_queue_depth', 'Uploaded videos waiting to be probed', fn=lambda: probe_worker.queue.qsize())
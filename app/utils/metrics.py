@@ -0,0 +1,266 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Secondes ; couvrent aussi bien une requête SQLite (sub-ms) qu'un encodage JPEG HD
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Value:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Metric:
+    """A named family of values, one per combination of label values.
+
+    With fn, nothing is recorded on the hot path: fn is called at scrape time
+    and returns a number, or a dict keyed by label value (or tuple of values).
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), fn=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames and fn is None:
+            self.default = self.labels()
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def inc(self, amount=1):
+        self.default.inc(amount)
+
+    def _values(self):
+        if self.fn is None:
+            return [(values, child.value) for values, child in list(self.children.items())]
+        result = self.fn()
+        if not isinstance(result, dict):
+            return [((), result)]
+        return [(key if isinstance(key, tuple) else (key,), value) for key, value in result.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, value in self._values():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.default.dec(amount)
+
+    def set(self, value):
+        self.default.set(value)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.default.observe(value)
+
+    def time(self):
+        return self.default.time()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class MetricsRegistry:
+    """In-process metrics, rendered in the Prometheus text format.
+
+    Values are per process: with several workers, each one is scraped
+    through its own port or aggregated upstream.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Métrique {name} déjà enregistrée avec un autre type")
+            return metric
+
+    def counter(self, name, documentation, labels=(), fn=None):
+        return self._register(Counter, name, documentation, labels, fn=fn)
+
+    def gauge(self, name, documentation, labels=(), fn=None):
+        return self._register(Gauge, name, documentation, labels, fn=fn)
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labels, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.error(f"Erreur lors de la collecte de la métrique {metric.name} : {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+    def init_app(self, app):
+        from flask import g, request
+        request_seconds = self.histogram('http_request_seconds', 'Time to produce a response, by endpoint',
+                                         ['endpoint', 'method'])
+
+        @app.before_request
+        def start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def record_request(response):
+            start = g.pop('metrics_start', None)
+            if start is not None:
+                # Endpoint plutôt que chemin : les 404 ne créent pas une série par URL
+                request_seconds.labels(request.endpoint or 'unmatched', request.method).observe(time.perf_counter() - start)
+            return response
+
+class SamplingProfiler:
+    """Samples the stack of every thread at a fixed rate and aggregates collapsed stacks.
+
+    The output ("thread;file:function;... count" per line) feeds flamegraph.pl
+    or speedscope. Under eventlet or gevent only OS threads are visible, so
+    greenlets show up as the hub.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.lock.locked()
+
+    def profile(self, seconds, interval=0.01):
+        """Sample for the given duration; returns None if a profile is already running."""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = defaultdict(int)
+            me = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)).replace(';', '_').replace(' ', '_'))
+                    stacks[';'.join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+            logging.info(f"Profil terminé : {samples} échantillons, {len(stacks)} piles distinctes")
+            return '\n'.join(f'{stack} {count}' for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+        finally:
+            self.lock.release()
+
+metrics = MetricsRegistry()
+profiler = SamplingProfiler()
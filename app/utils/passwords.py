@@ -0,0 +1,46 @@
+import threading
+from werkzeug.security import generate_password_hash, check_password_hash
+from .concurrency import blocking
+from .ratelimit import RateLimiter
+
+class PasswordHasher:
+    """Runs the password KDF off the event loop, at most PASSWORD_HASH_WORKERS at a time.
+
+    hashlib releases the GIL during scrypt and pbkdf2, so native threads
+    (blocking()) hash in parallel. A process pool is not used: it never
+    returns a result once eventlet has monkey-patched the worker.
+    """
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.prefix = None
+        self.slots = threading.BoundedSemaphore(2)
+
+    def init_app(self, app):
+        self.method = app.config['PASSWORD_HASH_METHOD']
+        self.slots = threading.BoundedSemaphore(app.config['PASSWORD_HASH_WORKERS'])
+        # Forme canonique des paramètres (ex. 'scrypt:32768:8:1'), telle que stockée dans le hash
+        self.prefix = generate_password_hash('', self.method).split('$', 1)[0]
+
+    def _run(self, fn, *args):
+        # Les requêtes en surnombre attendent ici (sans bloquer la boucle d'événements) plutôt que de saturer le CPU
+        with self.slots:
+            return blocking(fn, *args)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the hash was made with another algorithm or cost than the configured one."""
+        return pwhash.split('$', 1)[0] != self.prefix
+
+password_hasher = PasswordHasher()
+# Échecs de connexion par nom d'utilisateur et par IP, vérifiés avant tout calcul de hash
+login_limiter = RateLimiter()
+
+def init_app(app):
+    password_hasher.init_app(app)
+    login_limiter.configure(app.config['LOGIN_FAILURE_RATE'], app.config['LOGIN_FAILURE_BURST'])
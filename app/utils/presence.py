@@ -0,0 +1,83 @@
+import threading
+from .state import state
+
+class PresenceBroadcaster:
+    """Versioned join/leave deltas, coalesced over a short window and sent to one room.
+
+    The user list and version live in the state backend; pending changes are per worker.
+    """
+
+    def __init__(self, room='presence_room', window=0.25):
+        self.room = room
+        self.window = window
+        self.socketio = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+        self.deltas_sent = 0
+
+    def init_app(self, app, socketio):
+        self.socketio = socketio
+        self.window = app.config['PRESENCE_WINDOW_MS'] / 1000.0
+
+    def joined(self, user):
+        self._change(user['id'], user)
+
+    def left(self, user_id):
+        self._change(user_id, None)
+
+    def clear(self):
+        users = state.hgetall('presence')
+        with self.lock:
+            user_ids = list(users) + [str(u) for u in self.pending if str(u) not in users]
+        for user_id in user_ids:
+            self.left(user_id)
+
+    def _change(self, user_id, user):
+        user_id = str(user_id)
+        current = state.hget('presence', user_id)
+        with self.lock:
+            # Une arrivée suivie d'un départ dans la même fenêtre s'annule
+            if user is None and current is None:
+                self.pending.pop(user_id, None)
+            elif user is not None and current == user:
+                self.pending.pop(user_id, None)
+            else:
+                self.pending[user_id] = user
+            if self.pending and self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            self.timer = None
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            joined = []
+            left = []
+            for user_id, user in pending.items():
+                if user is None:
+                    if state.hget('presence', user_id) is not None:
+                        state.hdel('presence', user_id)
+                        left.append(_user_id(user_id))
+                else:
+                    state.hset('presence', user_id, user)
+                    joined.append(user)
+            if not joined and not left:
+                return
+            version = state.incr('presence_version')
+            delta = {'base_version': version - 1, 'version': version, 'joined': joined, 'left': left}
+            self.deltas_sent += 1
+        if self.socketio is not None:
+            self.socketio.emit('presence_delta', delta, to=self.room)
+
+    def snapshot(self):
+        return {'version': state.get('presence_version', 0), 'users': list(state.hgetall('presence').values())}
+
+def _user_id(key):
+    # Les champs du backend sont des chaînes ; les clients attendent l'identifiant d'origine
+    return int(key) if key.isdigit() else key
+
+presence = PresenceBroadcaster()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+class RateLimiter:
+    """Per-key token bucket: `rate` tokens per second, up to `burst` at once."""
+
+    def __init__(self, rate=1.0, burst=5, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.rejected = 0
+
+    def configure(self, rate, burst):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.buckets.clear()
+
+    def allow(self, key, cost=1.0):
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < cost:
+                self.buckets[key] = (tokens, now)
+                self.rejected += 1
+                return False
+            self.buckets[key] = (tokens - cost, now)
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+            return True
+
+    def check(self, key, cost=1.0):
+        """Whether allow() would succeed, without consuming anything."""
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            return min(self.burst, tokens + (now - last) * self.rate) >= cost
+
+    def _prune(self, now):
+        # Un seau plein n'apporte aucune information : on peut l'oublier
+        full_after = self.burst / self.rate if self.rate else 0
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < full_after}
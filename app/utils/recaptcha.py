@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from .cache import TTLCache
+
+VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+class GoogleBackend:
+    """Calls the siteverify API over a pooled keep-alive session."""
+
+    def __init__(self, secret_key, timeout=2.0, pool_size=10, url=VERIFY_URL):
+        import requests
+        from requests.adapters import HTTPAdapter
+        self.secret_key = secret_key
+        self.timeout = timeout
+        self.url = url
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def verify(self, token, remote_ip=None):
+        payload = {'secret': self.secret_key, 'response': token}
+        if remote_ip:
+            payload['remoteip'] = remote_ip
+        response = self.session.post(self.url, data=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return bool(response.json().get('success', False))
+
+class StubBackend:
+    """Offline backend: accepts every non-empty token (tests, deploys without Internet)."""
+
+    def __init__(self, result=True):
+        self.result = result
+
+    def verify(self, token, remote_ip=None):
+        return self.result and bool(token)
+
+class RecaptchaVerifier:
+    """Runs verifications on a bounded thread pool with a hard deadline and keeps metrics."""
+
+    def __init__(self):
+        self.backend = StubBackend()
+        self.executor = None
+        self.timeout = 3.0
+        # Jetons déjà soumis : un jeton n'est jamais accepté deux fois (Google les expire après 2 minutes)
+        self.consumed = TTLCache(maxsize=100000, ttl=180)
+        self.consumed_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.metrics = {'requests': 0, 'accepted': 0, 'rejected': 0, 'errors': 0, 'timeouts': 0,
+                        'replays': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+
+    def init_app(self, app, backend=None):
+        config = app.config
+        self.timeout = config['RECAPTCHA_TIMEOUT']
+        if backend is not None:
+            self.backend = backend
+        elif config['RECAPTCHA_BACKEND'] == 'stub':
+            logging.warning("reCAPTCHA désactivé : backend de test")
+            self.backend = StubBackend()
+        else:
+            self.backend = GoogleBackend(config['RECAPTCHA_SECRET_KEY'], timeout=self.timeout,
+                                         pool_size=config['RECAPTCHA_WORKERS'])
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = ThreadPoolExecutor(max_workers=config['RECAPTCHA_WORKERS'], thread_name_prefix='recaptcha')
+
+    def submit(self, token, remote_ip=None):
+        """Start a verification in the background; pass the result to result()."""
+        key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        self._count('requests')
+        with self.consumed_lock:
+            replayed = self.consumed.get(key) is not None
+            if not replayed:
+                self.consumed.set(key, True)
+        if replayed:
+            self._count('replays')
+            logging.warning("reCAPTCHA : jeton déjà utilisé")
+            future = Future()
+            future.set_result(False)
+            return future
+        return self.executor.submit(self._verify, token, remote_ip)
+
+    def result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            self._count('timeouts')
+            logging.error("reCAPTCHA : délai de vérification dépassé")
+            return False
+
+    def verify(self, token, remote_ip=None):
+        return self.result(self.submit(token, remote_ip))
+
+    def _verify(self, token, remote_ip):
+        start = time.perf_counter()
+        try:
+            success = self.backend.verify(token, remote_ip)
+        except Exception as e:
+            self._count('errors')
+            logging.error(f"Erreur lors de la vérification reCAPTCHA : {str(e)}")
+            return False
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.metrics['latency_total'] += elapsed
+                self.metrics['latency_max'] = max(self.metrics['latency_max'], elapsed)
+        self._count('accepted' if success else 'rejected')
+        return success
+
+    def _count(self, key):
+        with self.lock:
+            self.metrics[key] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.metrics)
+        completed = stats['accepted'] + stats['rejected'] + stats['errors']
+        stats['latency_avg'] = stats['latency_total'] / completed if completed else 0.0
+        return stats
+
+recaptcha = RecaptchaVerifier()
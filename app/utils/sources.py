@@ -0,0 +1,240 @@
+from abc import ABC, abstractmethod
+import cv2
+import logging
+import numpy as np
+import os
+import time
+
+# Heure de capture inscrite dans la mire : bits des millisecondes (modulo 2**32), en cases noires et blanches
+STAMP_BITS = 32
+
+def stamp_frame(frame, timestamp):
+    """Draw the capture time as a strip of black and white cells along the top of the frame."""
+    height, width = frame.shape[:2]
+    value = int(timestamp * 1000) & 0xFFFFFFFF
+    bits = (value >> np.arange(STAMP_BITS - 1, -1, -1)) & 1
+    strip = (bits[np.arange(width) * STAMP_BITS // width] * 255).astype(np.uint8)
+    frame[:max(height // 16, 4)] = strip[None, :, None]
+
+def read_stamp(frame):
+    """Read back the value written by stamp_frame(), after encoding and resizing."""
+    height, width = frame.shape[:2]
+    band = max(height // 16, 4)
+    if frame.ndim == 3:
+        frame = frame.mean(axis=2)
+    row = frame[band // 4:max(3 * band // 4, band // 4 + 1)].mean(axis=0)
+    value = 0
+    for bit in range(STAMP_BITS):
+        # Centre de chaque case, loin des bords flous laissés par le JPEG
+        start = int((bit + 0.25) * width / STAMP_BITS)
+        end = max(int((bit + 0.75) * width / STAMP_BITS), start + 1)
+        value = value << 1 | int(row[start:end].mean() > 127)
+    return value
+
+class FrameSource(ABC):
+    """Produces the BGR frames consumed by the live capture loop."""
+
+    name = None
+
+    @abstractmethod
+    def open(self):
+        pass
+
+    def wait(self):
+        """Sleep until the next frame is due; sources paced by their device return at once."""
+
+    @abstractmethod
+    def read(self):
+        """Return (success, frame), like cv2.VideoCapture.read()."""
+
+    @abstractmethod
+    def is_open(self):
+        pass
+
+    @abstractmethod
+    def fps(self):
+        pass
+
+    @abstractmethod
+    def frame_size(self):
+        pass
+
+    def close(self):
+        pass
+
+    def describe(self):
+        return self.name
+
+class PacedSource(FrameSource):
+    """Source without a clock of its own: the server releases one frame every 1/fps seconds."""
+
+    def __init__(self):
+        self.next_due = None
+
+    def wait(self):
+        now = time.monotonic()
+        if self.next_due is None or now - self.next_due > 1.0:
+            # Premier frame, ou boucle de capture trop lente : on se recale sans rafale
+            self.next_due = now
+        elif self.next_due > now:
+            time.sleep(self.next_due - now)
+        self.next_due += 1.0 / self.fps()
+
+class WebcamSource(FrameSource):
+    name = 'webcam'
+
+    def __init__(self, device=0):
+        self.device = device
+        self.capture = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.device)
+        if not self.capture.isOpened():
+            self.capture = None
+            raise Exception("Impossible d'ouvrir la webcam")
+
+    def read(self):
+        return self.capture.read()
+
+    def is_open(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def fps(self):
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        return fps if fps and fps > 0 else 20.0
+
+    def frame_size(self):
+        return (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+class VideoFileSource(PacedSource):
+    """Plays a file as a live broadcast, in a loop: every viewer sees the same position."""
+
+    name = 'file'
+
+    def __init__(self, path, loop=True):
+        super().__init__()
+        self.path = path
+        self.loop = loop
+        self.capture = None
+        self.rate = 25.0
+        self.size = None
+
+    def open(self):
+        if not os.path.isfile(self.path):
+            raise Exception(f"Vidéo introuvable : {os.path.basename(self.path)}")
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            self.capture = None
+            raise Exception(f"Impossible de lire la vidéo : {os.path.basename(self.path)}")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.rate = fps if fps and fps > 0 else 25.0
+        self.size = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def read(self):
+        success, frame = self.capture.read()
+        if not success and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.capture.read()
+        return success, frame
+
+    def is_open(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def fps(self):
+        return self.rate
+
+    def frame_size(self):
+        return self.size
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def describe(self):
+        return f"{self.name}:{os.path.basename(self.path)}"
+
+class SyntheticSource(PacedSource):
+    """Generated test pattern, for running the live pipeline and benchmarks without a camera.
+
+    'bars' draws colour bars crossed by a moving block and a frame counter,
+    under a strip holding the capture time (see read_stamp()); 'static' repeats the same image, as on a slide deck; 'noise' changes
+    every pixel of every frame.
+    """
+
+    name = 'synthetic'
+    PATTERNS = ('bars', 'static', 'noise')
+    COLOURS = [(255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+               (255, 0, 255), (0, 0, 255), (255, 0, 0), (0, 0, 0)]
+
+    def __init__(self, width=1280, height=720, fps=30.0, pattern='bars'):
+        if pattern not in self.PATTERNS:
+            raise ValueError(f"Motif inconnu : {pattern}")
+        super().__init__()
+        self.width = width
+        self.height = height
+        self.rate = fps
+        self.pattern = pattern
+        self.background = None
+        self.count = 0
+        self.rng = np.random.default_rng()
+        self.opened = False
+
+    def open(self):
+        bar_width = -(-self.width // len(self.COLOURS))
+        bars = np.repeat(np.array(self.COLOURS, dtype=np.uint8), bar_width, axis=0)[:self.width]
+        self.background = np.ascontiguousarray(np.broadcast_to(bars, (self.height, self.width, 3)))
+        self.count = 0
+        self.opened = True
+
+    def read(self):
+        self.count += 1
+        if self.pattern == 'static':
+            return True, self.background.copy()
+        if self.pattern == 'noise':
+            return True, self.rng.integers(0, 256, (self.height, self.width, 3), dtype=np.uint8)
+        frame = self.background.copy()
+        size = max(self.height // 6, 8)
+        x = (self.count * 8) % max(self.width - size, 1)
+        y = (self.height - size) // 2
+        frame[y:y + size, x:x + size] = 128
+        cv2.putText(frame, f"{self.count:08d}", (16, self.height - 16), cv2.FONT_HERSHEY_SIMPLEX,
+                    1.0, (255, 255, 255), 2, cv2.LINE_AA)
+        stamp_frame(frame, time.time())
+        return True, frame
+
+    def is_open(self):
+        return self.opened
+
+    def fps(self):
+        return self.rate
+
+    def frame_size(self):
+        return (self.width, self.height)
+
+    def close(self):
+        self.opened = False
+        self.background = None
+
+    def describe(self):
+        return f"{self.name}:{self.pattern}"
+
+# Types de stream servis par le pipeline live (/api/stream), par opposition à la VOD 'video'
+LIVE_STREAM_TYPES = ('webcam', 'live_video', 'synthetic')
+
+SOURCES = {
+    'webcam': WebcamSource,
+    'file': VideoFileSource,
+    'synthetic': SyntheticSource,
+}
+
+def create_source(kind, **options):
+    if kind not in SOURCES:
+        raise ValueError(f"Source inconnue : {kind}")
+    logging.debug(f"Création de la source {kind} : {options}")
+    return SOURCES[kind](**options)
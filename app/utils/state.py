@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+# Identifiant de ce processus auprès du backend partagé
+WORKER_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class MemoryState:
+    """In-process state backend: the default, for a single worker process."""
+
+    shared = False
+
+    def __init__(self):
+        self.values = {}
+        self.hashes = defaultdict(dict)
+        self.locks = {}
+        self.subscribers = defaultdict(list)
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            return self.values[key]
+
+    def hget(self, name, field):
+        with self.lock:
+            return self.hashes[name].get(str(field))
+
+    def hset(self, name, field, value):
+        with self.lock:
+            self.hashes[name][str(field)] = value
+
+    def hdel(self, name, field):
+        with self.lock:
+            self.hashes[name].pop(str(field), None)
+
+    def hincr(self, name, field, amount=1):
+        """Increment a hash field; the field is removed when it drops to zero."""
+        with self.lock:
+            value = self.hashes[name].get(str(field), 0) + amount
+            if value <= 0:
+                self.hashes[name].pop(str(field), None)
+            else:
+                self.hashes[name][str(field)] = value
+            return value
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes[name])
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self.hashes[name])
+
+    def delete(self, name):
+        with self.lock:
+            self.values.pop(name, None)
+            self.hashes.pop(name, None)
+
+    def acquire_lock(self, name, owner, ttl):
+        with self.lock:
+            holder = self.locks.get(name)
+            if holder is None or holder[0] == owner or holder[1] < time.monotonic():
+                self.locks[name] = (owner, time.monotonic() + ttl)
+                return True
+            return False
+
+    def release_lock(self, name, owner):
+        with self.lock:
+            if self.locks.get(name, (None,))[0] == owner:
+                del self.locks[name]
+
+    def publish(self, channel, message):
+        for callback in list(self.subscribers[channel]):
+            callback(message)
+
+    def subscribe(self, channel, callback):
+        self.subscribers[channel].append(callback)
+
+class RedisState:
+    """Redis-backed state shared by every worker process.
+
+    Works with any client exposing the redis-py API, so a local stand-in
+    (fakeredis, a Redis-compatible server) can be passed in tests.
+
+    Each hincr() is also recorded in a per-worker ledger. A worker whose
+    heartbeat expires (see heartbeat() and reap()) has its share of the
+    counters withdrawn by the others, so a crash leaves no phantom viewers.
+    """
+
+    shared = True
+
+    # Incrément, suppression à zéro et mise à jour du registre du worker en une seule opération
+    HINCR_SCRIPT = """
+local value = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if value <= 0 then redis.call('HDEL', KEYS[1], ARGV[1]) end
+if redis.call('HINCRBY', KEYS[2], ARGV[3], ARGV[2]) == 0 then redis.call('HDEL', KEYS[2], ARGV[3]) end
+return value
+"""
+
+    # Retire la part d'un worker dont la présence a expiré ; sans effet s'il est toujours là
+    REAP_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+local entries = redis.call('HGETALL', KEYS[2])
+for i = 1, #entries, 2 do
+    local sep = string.find(entries[i], '\\n', 1, true)
+    local key = ARGV[1] .. string.sub(entries[i], 1, sep - 1)
+    local field = string.sub(entries[i], sep + 1)
+    if redis.call('HINCRBY', key, field, -tonumber(entries[i + 1])) <= 0 then redis.call('HDEL', key, field) end
+end
+redis.call('DEL', KEYS[2])
+redis.call('SREM', KEYS[3], ARGV[2])
+return 1
+"""
+
+    def __init__(self, client=None, url=None, prefix='streaming:'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("Le backend d'état 'redis' nécessite le paquet redis (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.subscribers = defaultdict(list)
+        self.pubsub = None
+        self.listener = None
+        self.lock = threading.Lock()
+        self.hincr_script = client.register_script(self.HINCR_SCRIPT)
+        self.reap_script = client.register_script(self.REAP_SCRIPT)
+        # Copie locale du registre, pour le reconstituer si d'autres workers l'ont retiré
+        self.ledger = {}
+        self.ledger_lock = threading.Lock()
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def get(self, key, default=None):
+        value = self.client.get(self._key(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self._key(key), json.dumps(value))
+
+    def incr(self, key, amount=1):
+        return self.client.incrby(self._key(key), amount)
+
+    def hget(self, name, field):
+        value = self.client.hget(self._key(name), str(field))
+        return None if value is None else json.loads(value)
+
+    def hset(self, name, field, value):
+        self.client.hset(self._key(name), str(field), json.dumps(value))
+
+    def hdel(self, name, field):
+        self.client.hdel(self._key(name), str(field))
+
+    def _apply(self, name, field, amount):
+        return self.hincr_script(keys=[self._key(name), self._key('ledger:' + WORKER_ID)],
+                                 args=[field, amount, f"{name}\n{field}"])
+
+    def hincr(self, name, field, amount=1):
+        field = str(field)
+        with self.ledger_lock:
+            value = self._apply(name, field, amount)
+            total = self.ledger.get((name, field), 0) + amount
+            if total:
+                self.ledger[(name, field)] = total
+            else:
+                self.ledger.pop((name, field), None)
+        return value
+
+    def hgetall(self, name):
+        return {k.decode() if isinstance(k, bytes) else k: json.loads(v)
+                for k, v in self.client.hgetall(self._key(name)).items()}
+
+    def hlen(self, name):
+        return self.client.hlen(self._key(name))
+
+    def delete(self, name):
+        self.client.delete(self._key(name))
+
+    def acquire_lock(self, name, owner, ttl):
+        key = self._key('lock:' + name)
+        if self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        holder = self.client.get(key)
+        if holder is not None and (holder.decode() if isinstance(holder, bytes) else holder) == owner:
+            self.client.pexpire(key, int(ttl * 1000))
+            return True
+        return False
+
+    def release_lock(self, name, owner):
+        key = self._key('lock:' + name)
+        holder = self.client.get(key)
+        if holder is not None and (holder.decode() if isinstance(holder, bytes) else holder) == owner:
+            self.client.delete(key)
+
+    def heartbeat(self, ttl):
+        """Mark this worker alive for ttl seconds, restoring its counters if they were reaped meanwhile."""
+        alive = self._key('worker:' + WORKER_ID)
+        if self.client.set(alive, 1, xx=True, px=int(ttl * 1000)):
+            return
+        # Premier battement, ou présence expirée : le registre a pu être retiré entre-temps
+        ledger = self._key('ledger:' + WORKER_ID)
+        with self.ledger_lock:
+            self.client.set(alive, 1, px=int(ttl * 1000))
+            self.client.sadd(self._key('workers'), WORKER_ID)
+            for (name, field), amount in self.ledger.items():
+                recorded = int(self.client.hget(ledger, f"{name}\n{field}") or 0)
+                if recorded != amount:
+                    logging.warning(f"Compteur {name}[{field}] de ce worker restauré ({recorded} -> {amount})")
+                    self._apply(name, field, amount - recorded)
+
+    def reap(self):
+        """Withdraw the counters of workers whose heartbeat expired; returns their ids."""
+        reaped = []
+        for worker in self.client.smembers(self._key('workers')):
+            worker = worker.decode() if isinstance(worker, bytes) else worker
+            keys = [self._key('worker:' + worker), self._key('ledger:' + worker), self._key('workers')]
+            if self.reap_script(keys=keys, args=[self.prefix, worker]):
+                reaped.append(worker)
+        return reaped
+
+    def publish(self, channel, message):
+        if not isinstance(message, bytes):
+            message = json.dumps(message).encode()
+        self.client.publish(self._key(channel), message)
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            self.subscribers[self._key(channel)].append(callback)
+            if self.pubsub is None:
+                self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(**{self._key(channel): self._dispatch})
+            if self.listener is None:
+                self.listener = self.pubsub.run_in_thread(sleep_time=0.01, daemon=True)
+
+    def _dispatch(self, message):
+        channel = message['channel']
+        channel = channel.decode() if isinstance(channel, bytes) else channel
+        data = message['data']
+        for callback in list(self.subscribers[channel]):
+            try:
+                callback(data)
+            except Exception as e:
+                logging.error(f"Erreur dans l'abonné {channel} : {str(e)}")
+
+def decode(message):
+    """Decode a message received from publish(): JSON payloads are returned as objects."""
+    if isinstance(message, (bytes, bytearray)):
+        return json.loads(message)
+    return message
+
+class StateProxy:
+    """Module-level handle on the configured backend, swapped in by init_app()."""
+
+    def __init__(self):
+        self.backend = MemoryState()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+state = StateProxy()
+
+class SharedStats:
+    """Dict-like view of the stream stats stored in the state backend."""
+
+    DEFAULTS = {
+        'viewers': 0,
+        'total_views': 0,
+        'stream_active': False,
+        'uptime': 0,
+        'video_path': None,
+        'start_time': None,
+        'stream_type': None,
+    }
+
+    def __getitem__(self, key):
+        if key not in self.DEFAULTS:
+            raise KeyError(key)
+        return state.get('stats:' + key, self.DEFAULTS[key])
+
+    def __setitem__(self, key, value):
+        if key not in self.DEFAULTS:
+            raise KeyError(key)
+        state.set('stats:' + key, value)
+
+    def __contains__(self, key):
+        return key in self.DEFAULTS
+
+    def __iter__(self):
+        return iter(self.DEFAULTS)
+
+    def keys(self):
+        return self.DEFAULTS.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.DEFAULTS else default
+
+    def incr(self, key, amount=1):
+        return state.incr('stats:' + key, amount)
+
+    def __getattr__(self, key):
+        # Permet stats.viewers dans les templates
+        if key in SharedStats.DEFAULTS:
+            return self[key]
+        raise AttributeError(key)
+
+def create_backend(app):
+    kind = app.config['STATE_BACKEND']
+    if kind == 'memory':
+        return MemoryState()
+    if kind == 'redis':
+        return RedisState(url=app.config['STATE_REDIS_URL'])
+    raise ValueError(f"Backend d'état inconnu : {kind}")
+
+def _heartbeat(backend, ttl):
+    # Battement toutes les ttl/3 secondes, comme le verrou de la webcam
+    while True:
+        time.sleep(ttl / 3)
+        try:
+            backend.heartbeat(ttl)
+            for worker in backend.reap():
+                logging.warning(f"Worker {worker} disparu, ses compteurs partagés ont été retirés")
+        except Exception as e:
+            logging.error(f"Erreur lors du battement du worker : {str(e)}")
+
+def init_app(app, backend=None):
+    """Select the state backend; `backend` lets tests inject a stand-in."""
+    state.backend = backend or create_backend(app)
+    if state.backend.shared:
+        ttl = app.config['STATE_WORKER_TTL']
+        state.backend.heartbeat(ttl)
+        threading.Thread(target=_heartbeat, args=(state.backend, ttl), name='state-heartbeat', daemon=True).start()
+    return state.backend
@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from .concurrency import blocking
+
+THUMBNAIL_WIDTH = 320
+SPRITE_COLUMNS = 10
+SPRITE_ROWS = 10
+SPRITE_TILE_WIDTH = 160
+
+def _resize(frame, width):
+    height = max(1, int(frame.shape[0] * width / frame.shape[1]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+def _write_jpeg(path, image):
+    ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 80])
+    if not ret:
+        raise RuntimeError("Impossible d'encoder la miniature")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(buffer.tobytes())
+    os.replace(tmp_path, path)
+
+def render_thumbnail(source, destination, width=THUMBNAIL_WIDTH):
+    """Grab a frame at 10% of the video and save it as a JPEG thumbnail."""
+    capture = cv2.VideoCapture(source)
+    try:
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame_count // 10)
+        success, frame = capture.read()
+        if not success:
+            raise RuntimeError(f"Impossible de lire {source}")
+        _write_jpeg(destination, _resize(frame, width))
+    finally:
+        capture.release()
+
+def render_sprite(source, destination, columns=SPRITE_COLUMNS, rows=SPRITE_ROWS, width=SPRITE_TILE_WIDTH):
+    """Build a seek-preview sprite: columns x rows tiles evenly spaced through the video."""
+    capture = cv2.VideoCapture(source)
+    try:
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        tiles = columns * rows
+        sheet = None
+        for index in range(tiles):
+            if frame_count > 0:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, index * frame_count // tiles)
+            success, frame = capture.read()
+            if not success:
+                break
+            tile = _resize(frame, width)
+            if sheet is None:
+                sheet = np.zeros((tile.shape[0] * rows, width * columns, 3), dtype=np.uint8)
+            tile = tile[:sheet.shape[0] // rows]
+            y, x = (index // columns) * tile.shape[0], (index % columns) * width
+            sheet[y:y + tile.shape[0], x:x + width] = tile
+        if sheet is None:
+            raise RuntimeError(f"Impossible de lire {source}")
+        _write_jpeg(destination, sheet)
+    finally:
+        capture.release()
+
+RENDERERS = {
+    'thumbnail': render_thumbnail,
+    'sprite': render_sprite,
+}
+
+class ThumbnailCache:
+    """Disk cache of thumbnails and sprites, generated in the background and bounded by size (LRU).
+
+    OpenCV releases the GIL while decoding and resizing, so rendering runs on
+    native threads through blocking(); a process pool would hang under eventlet.
+    """
+
+    def __init__(self):
+        self.folder = None
+        self.upload_folder = None
+        self.max_bytes = 0
+        self.max_workers = None
+        self.executor = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.folder = app.config['THUMBNAIL_FOLDER']
+        self.upload_folder = app.config['UPLOAD_FOLDER']
+        self.max_bytes = app.config['THUMBNAIL_CACHE_SIZE']
+        self.max_workers = app.config['THUMBNAIL_WORKERS']
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _path(self, name, kind):
+        # La clé inclut mtime et taille : un fichier remplacé invalide son cache
+        st = os.stat(os.path.join(self.upload_folder, name))
+        key = hashlib.sha1(f"{name}:{st.st_mtime_ns}:{st.st_size}:{kind}".encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, f"{key}.jpg")
+
+    def get(self, name, kind):
+        """Return the cached image path, or None after scheduling its generation."""
+        path = self._path(name, kind)
+        if os.path.exists(path):
+            # mtime sert d'horodatage LRU
+            os.utime(path)
+            return path
+        self._submit(name, kind, path)
+        return None
+
+    def warm(self, name):
+        for kind in RENDERERS:
+            self.get(name, kind)
+
+    def _submit(self, name, kind, path):
+        with self.lock:
+            if path in self.pending:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='thumbnails')
+            future = self.executor.submit(blocking, RENDERERS[kind], os.path.join(self.upload_folder, name), path)
+            self.pending[path] = future
+        future.add_done_callback(lambda f: self._done(path, name, f))
+
+    def _done(self, path, name, future):
+        with self.lock:
+            self.pending.pop(path, None)
+        error = future.exception()
+        if error is not None:
+            logging.error(f"Erreur lors de la génération de l'aperçu de {name} : {str(error)}")
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.jpg'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+thumbnail_cache = ThumbnailCache()
@@ -0,0 +1,476 @@
+"""Load and latency benchmark.
+
+    python benchmark.py --viewers 50 --chatters 20 --logins 200 --output results.json
+
+Démarre serve.py sur une base temporaire, avec la mire de test et le reCAPTCHA
+factice, puis mesure le live (spectateurs MJPEG et chat Socket.IO en parallèle)
+et une rafale de connexions. Le résultat est un JSON à comparer d'une version
+à l'autre ; la progression s'affiche sur stderr.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import secrets
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+FORMAT_VERSION = 1
+PASSWORD = 'benchmark-password'
+MESSAGE_PATTERN = re.compile(r'^bench (\d+) (\d+\.\d+)$')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de charge et de latence du streaming")
+    parser.add_argument('--viewers', type=int, default=20, help="Spectateurs MJPEG sur /api/stream")
+    parser.add_argument('--rendition', default='low', choices=['low', 'med', 'high'])
+    parser.add_argument('--chatters', type=int, default=10, help="Clients Socket.IO dans stream_room")
+    parser.add_argument('--chat-rate', type=float, default=0.5, help="Messages par seconde et par client")
+    parser.add_argument('--duration', type=float, default=20, help="Durée de la phase live, en secondes")
+    parser.add_argument('--warmup', type=float, default=2, help="Secondes ignorées au début de la phase live")
+    parser.add_argument('--logins', type=int, default=100, help="Connexions de la rafale (login, /stream, /dashboard)")
+    parser.add_argument('--login-concurrency', type=int, default=10)
+    parser.add_argument('--pattern', default='bars', choices=['bars', 'static', 'noise'],
+                        help="Motif de la mire ; la latence des frames n'est mesurée qu'avec 'bars'")
+    parser.add_argument('--size', default='1280x720', help="Résolution de la mire")
+    parser.add_argument('--fps', type=float, default=30)
+    parser.add_argument('--latency-sample', type=int, default=5,
+                        help="Un frame sur N est décodé pour mesurer la latence")
+    parser.add_argument('--async-mode', default='threading', choices=['auto', 'eventlet', 'gevent', 'threading'])
+    parser.add_argument('--server-env', action='append', default=[], metavar='CLE=VALEUR',
+                        help="Configuration supplémentaire du serveur, ex. CHAT_RATE=10 (répétable)")
+    parser.add_argument('--output', default='-', help="Fichier JSON de sortie ('-' : sortie standard)")
+    return parser.parse_args(argv)
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+def percentiles(values):
+    """Summary in milliseconds of a list of durations in seconds."""
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def rank(q):
+        return round(values[min(int(q * len(values)), len(values) - 1)] * 1000, 3)
+
+    return {
+        'count': len(values),
+        'mean': round(sum(values) / len(values) * 1000, 3),
+        'p50': rank(0.50),
+        'p90': rank(0.90),
+        'p99': rank(0.99),
+        'max': round(values[-1] * 1000, 3),
+    }
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def seed_database(path, users):
+    """Create the schema and the benchmark accounts, all sharing one password hash."""
+    from werkzeug.security import generate_password_hash
+    from app.config import Config
+    from app.migrations import run_migrations
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    run_migrations(conn)
+    pwhash = generate_password_hash(PASSWORD, method=Config.PASSWORD_HASH_METHOD)
+    now = datetime.now().isoformat()
+    conn.execute('INSERT INTO users (username, email, password, role, created_at, active) VALUES (?, ?, ?, ?, ?, ?)',
+                 ('bench_admin', 'bench_admin@example.com', pwhash, 'admin', now, 1))
+    conn.executemany('INSERT INTO users (username, email, password, role, created_at, active) VALUES (?, ?, ?, ?, ?, ?)',
+                     [(f'bench_{i}', f'bench_{i}@example.com', pwhash, 'viewer', now, 1) for i in range(users)])
+    # Demandes déjà acceptées : /stream et le chat sont ouverts à tous les comptes
+    conn.execute("""INSERT INTO stream_requests (user_id, status, requested_at)
+        SELECT id, 'accepted', ? FROM users WHERE username LIKE 'bench\\_%' ESCAPE '\\'""", (now,))
+    conn.commit()
+    conn.close()
+
+class ServerProcess:
+    """serve.py in a child process, with CPU and memory sampled from /proc."""
+
+    def __init__(self, args, workdir):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        env = dict(os.environ)
+        env.update({
+            'DATABASE': os.path.join(workdir, 'bench.db'),
+            'SECRET_KEY': secrets.token_hex(16),
+            'RECAPTCHA_BACKEND': 'stub',
+            'STATE_BACKEND': 'memory',
+            'SERVER_WORKERS': '1',
+            'SYNTHETIC_SIZE': args.size,
+            'SYNTHETIC_FPS': str(args.fps),
+        })
+        for item in args.server_env:
+            key, _, value = item.partition('=')
+            env[key] = value
+        self.log_file = open(os.path.join(workdir, 'server.log'), 'wb')
+        serve = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serve.py')
+        self.process = subprocess.Popen([sys.executable, serve, '--host', '127.0.0.1', '--port', str(self.port),
+                                         '--async-mode', args.async_mode],
+                                        env=env, cwd=workdir, stdout=self.log_file, stderr=subprocess.STDOUT)
+        self.samples = []
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self._sample_loop, name='bench-sampler', daemon=True)
+
+    def wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Le serveur s'est arrêté (statut {self.process.returncode}), voir server.log")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            raise RuntimeError("Le serveur ne répond pas")
+        self.sampler.start()
+
+    def _read_proc(self):
+        pid = self.process.pid
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+            with open(f'/proc/{pid}/status') as f:
+                rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration, ValueError):
+            return None
+        return (time.monotonic(), cpu, rss)
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(0.5):
+            sample = self._read_proc()
+            if sample is not None:
+                self.samples.append(sample)
+
+    def resources(self, start, end):
+        """CPU use and resident memory of the server between two time.monotonic() marks."""
+        window = [s for s in self.samples if start <= s[0] <= end]
+        if len(window) < 2:
+            return None
+        elapsed = window[-1][0] - window[0][0]
+        return {
+            'cpu_percent': round((window[-1][1] - window[0][1]) / elapsed * 100, 1) if elapsed else None,
+            'rss_max_mb': round(max(s[2] for s in window) / 1024 ** 2, 1),
+            'rss_end_mb': round(window[-1][2] / 1024 ** 2, 1),
+        }
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=20)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.log_file.close()
+
+def login(base, username):
+    import requests
+    session = requests.Session()
+    timings = {}
+    start = time.perf_counter()
+    session.get(f'{base}/login', timeout=30).raise_for_status()
+    timings['login_page'] = time.perf_counter() - start
+    start = time.perf_counter()
+    response = session.post(f'{base}/login', allow_redirects=False, timeout=30,
+                            data={'username': username, 'password': PASSWORD, 'g-recaptcha-response': secrets.token_hex(8)})
+    timings['login'] = time.perf_counter() - start
+    if response.status_code != 302 or 'session' not in session.cookies or '/login' in response.headers.get('Location', ''):
+        raise RuntimeError(f"Échec de connexion de {username} ({response.status_code})")
+    return session, timings
+
+class DbStats:
+    """Query counters of the server's connection pool, read through /api/db_stats."""
+
+    def __init__(self, admin, base):
+        self.admin = admin
+        self.base = base
+
+    def read(self):
+        return self.admin.get(f'{self.base}/api/db_stats', timeout=30).json()
+
+    @staticmethod
+    def delta(before, after, requests):
+        queries = after['queries'] - before['queries']
+        query_time = after['query_time'] - before['query_time']
+        return {
+            'queries': queries,
+            'query_time_ms': round(query_time * 1000, 3),
+            'requests': requests,
+            'queries_per_request': round(queries / requests, 3) if requests else None,
+            'ms_per_request': round(query_time * 1000 / requests, 3) if requests else None,
+        }
+
+class Viewer(threading.Thread):
+    """Reads the MJPEG stream, counting frames and decoding the capture stamp of some of them."""
+
+    def __init__(self, base, rendition, sample_every, measure_latency):
+        super().__init__(name='bench-viewer', daemon=True)
+        self.url = f'{base}/api/stream?q={rendition}'
+        self.sample_every = sample_every
+        self.measure_latency = measure_latency
+        self.frames = 0
+        self.bytes = 0
+        self.latencies = []
+        self.error = None
+        self.measuring = False
+        self.closed = False
+        self.response = None
+
+    def run(self):
+        import requests
+        try:
+            self.response = requests.get(self.url, stream=True, timeout=30)
+            self.response.raise_for_status()
+            buffer = b''
+            for chunk in self.response.iter_content(65536):
+                buffer += chunk
+                while True:
+                    start = buffer.find(b'\r\n\r\n')
+                    # Le JPEG se termine par FF D9, qui n'apparaît pas ailleurs dans les données compressées
+                    end = buffer.find(b'\xff\xd9\r\n', start + 4) if start >= 0 else -1
+                    if end < 0:
+                        break
+                    self._on_frame(buffer[start + 4:end + 2])
+                    buffer = buffer[end + 4:]
+        except Exception as e:
+            if not self.closed:
+                self.error = str(e)
+
+    def _on_frame(self, jpeg):
+        received = time.time()
+        if not self.measuring:
+            return
+        self.frames += 1
+        self.bytes += len(jpeg)
+        if self.measure_latency and self.frames % self.sample_every == 0:
+            import cv2
+            import numpy as np
+            from app.utils.sources import read_stamp
+            image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is not None:
+                latency = ((int(received * 1000) - read_stamp(image)) & 0xFFFFFFFF) / 1000
+                # Au-delà d'une minute, la bande horaire a été mal lue
+                if latency < 60:
+                    self.latencies.append(latency)
+
+    def close(self):
+        self.measuring = False
+        self.closed = True
+        if self.response is not None:
+            self.response.close()
+
+class Chatter:
+    """Socket.IO client that joins the stream and sends stamped chat messages."""
+
+    def __init__(self, number, base, session):
+        import socketio
+        self.number = number
+        self.base = base
+        self.cookie = '; '.join(f'{name}={value}' for name, value in session.cookies.items())
+        self.client = socketio.Client(reconnection=False)
+        self.client.on('new_message', self._on_message)
+        self.client.on('chat_error', self._on_error)
+        self.sent = 0
+        self.rejected = 0
+        self.received = 0
+        self.latencies = []
+        self.measuring = False
+
+    def connect(self):
+        self.client.connect(self.base, headers={'Cookie': self.cookie}, wait_timeout=30)
+        self.client.emit('join_stream')
+
+    def send(self):
+        self.sent += 1
+        self.client.emit('send_message', {'message': f'bench {self.number} {time.time():.6f}'})
+
+    def _on_message(self, entry):
+        received = time.time()
+        match = MESSAGE_PATTERN.match(entry.get('message', ''))
+        if match is None or not self.measuring:
+            return
+        self.received += 1
+        self.latencies.append(received - float(match.group(2)))
+
+    def _on_error(self, data):
+        self.rejected += 1
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+def run_live(args, server, admin, db):
+    measure_latency = args.pattern == 'bars'
+    viewers = [Viewer(server.url, args.rendition, max(args.latency_sample, 1), measure_latency)
+               for _ in range(args.viewers)]
+    for viewer in viewers:
+        viewer.start()
+    chatters = []
+    for number in range(args.chatters):
+        session, _ = login(server.url, f'bench_{number}')
+        chatter = Chatter(number, server.url, session)
+        chatter.connect()
+        chatters.append(chatter)
+    log(f"Live : {len(viewers)} spectateurs, {len(chatters)} clients de chat, préchauffage {args.warmup} s")
+    time.sleep(args.warmup)
+
+    before = db.read()
+    for client in viewers + chatters:
+        client.measuring = True
+    start = time.monotonic()
+    deadline = start + args.duration
+    interval = 1 / args.chat_rate if args.chat_rate > 0 else None
+    # Envois répartis sur l'intervalle pour éviter que tous les clients parlent en même temps
+    next_send = [start + interval * i / max(len(chatters), 1) for i in range(len(chatters))] if interval else []
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        for i, chatter in enumerate(chatters):
+            if now >= next_send[i]:
+                chatter.send()
+                next_send[i] += interval
+        time.sleep(min(0.01, max(deadline - time.monotonic(), 0)))
+    # Laisse arriver les derniers messages diffusés
+    time.sleep(1.0)
+    elapsed = time.monotonic() - start
+    for viewer in viewers:
+        viewer.measuring = False
+    for chatter in chatters:
+        chatter.measuring = False
+    after = db.read()
+    end = time.monotonic()
+    camera = admin.get(f'{server.url}/api/camera_stats', timeout=30).json()
+    for client in viewers + chatters:
+        client.close()
+
+    frames = sum(v.frames for v in viewers)
+    sent = sum(c.sent for c in chatters)
+    rejected = sum(c.rejected for c in chatters)
+    return {
+        'stream': {
+            'viewers': len(viewers),
+            'rendition': args.rendition,
+            'frames': frames,
+            'frames_per_second': round(frames / elapsed, 2),
+            'frames_per_viewer_per_second': round(frames / elapsed / len(viewers), 2) if viewers else None,
+            'bytes_per_second': round(sum(v.bytes for v in viewers) / elapsed),
+            'latency_ms': percentiles([l for v in viewers for l in v.latencies]) if measure_latency else None,
+            'errors': [v.error for v in viewers if v.error],
+            'capture': camera,
+        },
+        'chat': {
+            'clients': len(chatters),
+            'messages_sent': sent,
+            'messages_rejected': rejected,
+            'deliveries': sum(c.received for c in chatters),
+            'expected_deliveries': (sent - rejected) * len(chatters),
+            'fanout_latency_ms': percentiles([l for c in chatters for l in c.latencies]),
+        },
+        'duration': round(elapsed, 3),
+        'db': DbStats.delta(before, after, sent),
+        'server': server.resources(start, end),
+    }
+
+def run_auth(args, server, db):
+    def visit(number):
+        username = f'bench_{number % max(args.logins, 1)}'
+        session, timings = login(server.url, username)
+        for name, path in (('stream_page', '/stream'), ('dashboard', '/dashboard')):
+            start = time.perf_counter()
+            response = session.get(f'{server.url}{path}', allow_redirects=False, timeout=30)
+            timings[name] = time.perf_counter() - start
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} : statut {response.status_code}")
+        session.close()
+        return timings
+
+    log(f"Authentification : {args.logins} connexions, {args.login_concurrency} en parallèle")
+    before = db.read()
+    start = time.monotonic()
+    results, errors = [], []
+    with ThreadPoolExecutor(max_workers=args.login_concurrency) as executor:
+        for future in [executor.submit(visit, number) for number in range(args.logins)]:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                errors.append(str(e))
+    end = time.monotonic()
+    after = db.read()
+    elapsed = end - start
+    return {
+        'logins': args.logins,
+        'completed': len(results),
+        'errors': errors[:20],
+        'error_count': len(errors),
+        'duration': round(elapsed, 3),
+        'logins_per_second': round(len(results) / elapsed, 2),
+        'latency_ms': {name: percentiles([r[name] for r in results])
+                       for name in ('login_page', 'login', 'stream_page', 'dashboard')},
+        # Quatre requêtes HTTP par connexion
+        'db': DbStats.delta(before, after, len(results) * 4),
+        'server': server.resources(start, end),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    seed_database(os.path.join(workdir, 'bench.db'), max(args.chatters, args.logins, 1))
+    server = ServerProcess(args, workdir)
+    results = {
+        'format': FORMAT_VERSION,
+        'started_at': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': vars(args),
+    }
+    try:
+        server.wait_ready()
+        log(f"Serveur prêt sur {server.url} (journal : {workdir}/server.log)")
+        admin, _ = login(server.url, 'bench_admin')
+        response = admin.post(f'{server.url}/api/control_stream', timeout=30,
+                              json={'action': 'start', 'stream_type': 'synthetic', 'pattern': args.pattern})
+        if response.status_code != 204:
+            raise RuntimeError(f"Démarrage de la mire impossible ({response.status_code}) : {response.text}")
+        db = DbStats(admin, server.url)
+        if args.viewers or args.chatters:
+            results['live'] = run_live(args, server, admin, db)
+        if args.logins:
+            results['auth'] = run_auth(args, server, db)
+        admin.post(f'{server.url}/api/control_stream', json={'action': 'stop'}, timeout=30)
+    finally:
+        server.stop()
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        log(f"Résultats écrits dans {args.output}")
+
+if __name__ == '__main__':
+    main()
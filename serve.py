@@ -0,0 +1,250 @@
+"""Production entry point.
+
+    python serve.py --async-mode eventlet --workers 4
+
+run.py reste le serveur de développement (Werkzeug, debug et rechargement).
+Les options ont leur équivalent en variables d'environnement (SERVER_*).
+"""
+import argparse
+import os
+import signal
+import sys
+import time
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serveur de production du streaming")
+    parser.add_argument('--host', default=os.getenv('SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('SERVER_PORT', 5000)))
+    parser.add_argument('--async-mode', choices=['auto', 'eventlet', 'gevent', 'threading'],
+                        default=os.getenv('SERVER_ASYNC_MODE', 'auto'),
+                        help="auto : eventlet, puis gevent, puis threading selon ce qui est installé")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SERVER_WORKERS', 1)),
+                        help="Processus partageant le port (SO_REUSEPORT) ; au-delà de 1, nécessite "
+                             "STATE_BACKEND=redis, SOCKETIO_MESSAGE_QUEUE et des clients en WebSocket "
+                             "ou un répartiteur à sessions collantes")
+    parser.add_argument('--max-connections', type=int, default=int(os.getenv('SERVER_MAX_CONNECTIONS', 10000)),
+                        help="Connexions simultanées par processus")
+    parser.add_argument('--backlog', type=int, default=int(os.getenv('SERVER_BACKLOG', 2048)))
+    parser.add_argument('--keepalive', type=float, default=float(os.getenv('SERVER_KEEPALIVE', 5)),
+                        help="Inactivité tolérée entre deux requêtes HTTP, en secondes (0 : désactivé ; "
+                             "sans effet sous gevent)")
+    parser.add_argument('--shutdown-timeout', type=float, default=float(os.getenv('SERVER_SHUTDOWN_TIMEOUT', 10)),
+                        help="Délai laissé aux connexions en cours après SIGTERM")
+    return parser.parse_args(argv)
+
+def resolve_mode(mode):
+    if mode != 'auto':
+        return mode
+    for candidate in ('eventlet', 'gevent'):
+        try:
+            __import__(candidate)
+        except ImportError:
+            continue
+        return candidate
+    return 'threading'
+
+def monkey_patch(mode):
+    # Doit précéder tout import de l'application (threading, socket, time)
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+def listen(host, port, backlog, reuse_port=False):
+    import socket
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Le noyau répartit les connexions entrantes entre les workers
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+class EventletServer:
+    def __init__(self, app, sock, args):
+        import eventlet
+        import eventlet.wsgi
+        self.sock = sock
+        self.pool = eventlet.GreenPool(args.max_connections)
+        self.thread = eventlet.spawn(eventlet.wsgi.server, sock, app, custom_pool=self.pool,
+                                     keepalive=args.keepalive or False, log_output=False)
+
+    def active(self):
+        return self.pool.running()
+
+    def close(self):
+        self.thread.kill()
+        self.sock.close()
+
+class GeventServer:
+    def __init__(self, app, sock, args):
+        from gevent import pywsgi
+        from gevent.pool import Pool
+        try:
+            from geventwebsocket.handler import WebSocketHandler
+            handler_class = WebSocketHandler
+        except ImportError:
+            handler_class = pywsgi.WSGIHandler
+        self.pool = Pool(args.max_connections)
+        self.server = pywsgi.WSGIServer(sock, app, spawn=self.pool, handler_class=handler_class, log=None)
+        self.server.start()
+
+    def active(self):
+        return len(self.pool)
+
+    def close(self):
+        self.server.close()
+
+class ThreadingServer:
+    def __init__(self, app, sock, args):
+        import threading
+        from werkzeug.serving import make_server, WSGIRequestHandler
+
+        class RequestHandler(WSGIRequestHandler):
+            if args.keepalive:
+                protocol_version = 'HTTP/1.1'
+                timeout = args.keepalive
+
+        self.sock = sock
+        self.slots = threading.BoundedSemaphore(args.max_connections)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.server = make_server(args.host, args.port, app, threaded=True, request_handler=RequestHandler,
+                                  fd=sock.fileno())
+        process_request = self.server.process_request
+        shutdown_request = self.server.shutdown_request
+
+        # Connexions détenant un créneau : chacun est rendu une seule fois, quel que soit le chemin de sortie
+        held = set()
+
+        def release(request):
+            with self.lock:
+                if request not in held:
+                    return
+                held.discard(request)
+                self.count -= 1
+            self.slots.release()
+
+        def limited_process_request(request, client_address):
+            # Au-delà de la limite, on cesse d'accepter : les connexions attendent dans le backlog
+            self.slots.acquire()
+            with self.lock:
+                held.add(request)
+                self.count += 1
+            try:
+                process_request(request, client_address)
+            except BaseException:
+                # Thread de traitement non démarré : personne d'autre ne rendrait le créneau
+                release(request)
+                raise
+
+        def counted_shutdown_request(request):
+            try:
+                shutdown_request(request)
+            finally:
+                release(request)
+
+        self.server.process_request = limited_process_request
+        self.server.shutdown_request = counted_shutdown_request
+        self.thread = threading.Thread(target=self.server.serve_forever, name='http-server', daemon=True)
+        self.thread.start()
+
+    def active(self):
+        with self.lock:
+            return self.count
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+SERVERS = {
+    'eventlet': EventletServer,
+    'gevent': GeventServer,
+    'threading': ThreadingServer,
+}
+
+def run_worker(args, mode, reuse_port=False):
+    monkey_patch(mode)
+    sock = listen(args.host, args.port, args.backlog, reuse_port)
+    os.environ['SOCKETIO_ASYNC_MODE'] = mode
+
+    import logging
+    from app import create_app
+    from app.utils.camera_control import camera_control
+
+    app = create_app()
+    server = SERVERS[mode](app, sock, args)
+    stopping = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.append(signum))
+    logging.info(f"Serveur {mode} démarré sur {args.host}:{args.port} (pid {os.getpid()})")
+    while not stopping:
+        time.sleep(0.5)
+
+    logging.info(f"Arrêt du serveur (pid {os.getpid()}), {server.active()} connexions en cours")
+    server.close()
+    # Termine les flux MJPEG, qui sinon ne se ferment jamais
+    camera_control.shutdown()
+    deadline = time.monotonic() + args.shutdown_timeout
+    while server.active() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if server.active():
+        logging.warning(f"{server.active()} connexions interrompues à l'arrêt")
+    # Les handlers atexit vident ensuite les messages, sessions et statistiques en attente
+
+def supervise(args, mode):
+    if os.getenv('STATE_BACKEND', 'memory') == 'memory' or not os.getenv('SOCKETIO_MESSAGE_QUEUE'):
+        sys.exit("--workers > 1 nécessite STATE_BACKEND=redis et SOCKETIO_MESSAGE_QUEUE")
+    import logging
+    logger = logging.getLogger('serve.supervisor')
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s superviseur : %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    children = set()
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            run_worker(args, mode, reuse_port=True)
+            sys.exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(args.workers):
+        spawn()
+    logger.info(f"{args.workers} workers {mode} démarrés sur {args.host}:{args.port}")
+    while children:
+        pid, status = os.wait()
+        children.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} arrêté (statut {status}), redémarrage")
+            time.sleep(1)
+            spawn()
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    load_dotenv()
+    args = parse_args(argv)
+    mode = resolve_mode(args.async_mode)
+    if args.workers > 1:
+        supervise(args, mode)
+    else:
+        run_worker(args, mode)
+
+if __name__ == '__main__':
+    main()